@@ -0,0 +1,294 @@
+"""Потоковая фильтрация вакансий по эталонному списку профессий.
+
+Заменяет цикл из filtration.ipynb: дамп распаковывается в отдельном потоке,
+названия вакансий кодируются большими батчами и только один раз -
+результат сопоставления кэшируется по названию, а подходящие вакансии
+дописываются в выходной gzip по мере обработки.
+
+Запуск:
+    python filtration.py --input ../INPUT_DATA/hh_2023-01-01_2023-04-01.csv.bz2
+"""
+import argparse
+import gzip
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import torch
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.embedding_cache import EmbeddingCache
+from common.encoders import BACKENDS, make_encoder
+from lexical_index import AMBIGUOUS, EXACT, LexicalIndex
+
+PROFESSIONS_PATH = "../INPUT_DATA/professions.xlsx"
+INPUT_FILE = "../INPUT_DATA/hh_2023-01-01_2023-04-01.csv.bz2"
+OUTPUT_FILE = "results/filtered_vacancies.csv.gz"
+
+MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+READ_CHUNKSIZE = 20000
+ENCODE_BATCH_SIZE = 256
+READ_QUEUE_SIZE = 4
+SIM_THRESHOLD = 0.95
+MAX_RESULTS = 0  # 0 - без ограничения
+MIN_DESC_LEN = 100
+MAX_DESC_LEN = 2000
+USE_EMBEDDING_CACHE = True
+# Не float16: округление может перевести название через порог 0.95
+EMBEDDING_CACHE_DTYPE = "float32"
+USE_LEXICAL_INDEX = True
+ENCODER_BACKEND = "torch"  # "onnx" - квантованная модель в onnxruntime, см. common/encoders.py
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+INPUT_COLUMNS = ["_id", "name", "description"]
+OUTPUT_COLUMNS = ["_id", "name", "best_profession", "description"]
+
+
+def load_professions(path: str) -> list[str]:
+    prof_df = pd.read_excel(path)
+    return prof_df["профессия"].dropna().astype(str).str.lower().tolist()
+
+
+class TitleMatcher:
+    """Сопоставляет названия вакансий с профессиями, кэшируя результат по названию"""
+
+    def __init__(self, encoder, professions: list[str], batch_size: int = ENCODE_BATCH_SIZE,
+                 embedding_cache: EmbeddingCache | None = None, lexical_index: LexicalIndex | None = None):
+        self.encoder = encoder
+        self.professions = professions
+        self.batch_size = batch_size
+        self.embedding_cache = embedding_cache
+        self.lexical_index = lexical_index
+        self.profession_embeds = self._embed(professions)
+        # название -> (индекс лучшей профессии, сходство, каким путём найдено)
+        self.cache: dict[str, tuple[int, float, str]] = {}
+        self.lookups = 0
+        self.encoded = 0
+        # Сколько уникальных названий и строк прошло каждым путём
+        self.path_titles = Counter()
+        self.path_rows = Counter()
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        return self.encoder.encode(texts, batch_size=self.batch_size)
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        if self.embedding_cache is None:
+            return self._encode(texts)
+        return self.embedding_cache.get_or_compute(texts, self._encode)
+
+    def _encode_and_match(self, titles: list[str]):
+        # Векторы нормализованы, поэтому косинусное сходство - скалярное произведение
+        sim_matrix = self._embed(titles) @ self.profession_embeds.T
+        best_indices = sim_matrix.argmax(axis=1)
+        max_scores = sim_matrix[np.arange(len(titles)), best_indices]
+
+        for title, idx, score in zip(titles, best_indices.tolist(), max_scores.tolist()):
+            self.cache[title] = (idx, score, AMBIGUOUS)
+        self.encoded += len(titles)
+
+    def _resolve(self, titles: list[str]):
+        """Сначала лексический индекс, на модель уходят только неоднозначные названия"""
+        ambiguous = []
+        for title in titles:
+            if self.lexical_index is None:
+                ambiguous.append(title)
+                continue
+
+            path, idx, score = self.lexical_index.lookup(title)
+            if path == EXACT:
+                self.cache[title] = (idx, score, path)
+            else:
+                ambiguous.append(title)
+
+        if ambiguous:
+            self._encode_and_match(ambiguous)
+        self.path_titles.update(self.cache[t][2] for t in titles)
+
+    def match(self, titles: list[str]) -> tuple[list[str], list[float]]:
+        """Возвращает лучшую профессию и сходство для каждого названия"""
+        self.lookups += len(titles)
+        unseen = [t for t in dict.fromkeys(titles) if t not in self.cache]
+        if unseen:
+            self._resolve(unseen)
+
+        matches = [self.cache[t] for t in titles]
+        self.path_rows.update(path for _, _, path in matches)
+        return [self.professions[i] for i, _, _ in matches], [s for _, s, _ in matches]
+
+    def stats(self) -> dict:
+        stats = {
+            "titles": self.lookups,
+            "encoded": self.encoded,
+            "cached_titles": len(self.cache),
+            "paths": {path: {"titles": self.path_titles[path], "rows": self.path_rows[path]}
+                      for path in (EXACT, AMBIGUOUS)},
+        }
+        if self.embedding_cache is not None:
+            stats["embedding_cache"] = self.embedding_cache.stats()
+        return stats
+
+
+def process_chunk(chunk: pd.DataFrame, matcher: TitleMatcher, threshold: float = SIM_THRESHOLD) -> pd.DataFrame:
+    """Этап пайплайна: чистит чанк и оставляет вакансии, похожие на эталонные профессии"""
+    chunk = chunk.dropna(subset=["name", "description"]).copy()
+    chunk["desc_len"] = chunk["description"].str.len()
+    chunk = chunk[(chunk["desc_len"] >= MIN_DESC_LEN) & (chunk["desc_len"] <= MAX_DESC_LEN)].copy()
+
+    if chunk.empty:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+    chunk["name_clean"] = chunk["name"].str.lower().str.strip()
+    best_professions, similarity = matcher.match(chunk["name_clean"].tolist())
+    chunk["best_profession"] = best_professions
+    chunk["similarity"] = similarity
+
+    filtered = chunk[chunk["similarity"] >= threshold]
+    return filtered[OUTPUT_COLUMNS]
+
+
+def _read_chunks(path: str, chunksize: int, skip_rows: int, out: queue.Queue, stop: threading.Event):
+    """Поток чтения: распаковывает дамп и кладёт чанки в очередь, в конце - None"""
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        # Пропуск числом строк с явными именами столбцов: парсер не строит множество номеров пропускаемых строк
+        names = pd.read_csv(path, nrows=0).columns.tolist()
+        reader = pd.read_csv(path, chunksize=chunksize, dtype={"_id": str}, usecols=INPUT_COLUMNS,
+                             header=None, names=names, skiprows=skip_rows + 1)
+        for chunk in reader:
+            if not put(chunk):
+                return
+    except Exception as e:
+        put(e)
+    put(None)
+
+
+def iter_chunks(path: str, chunksize: int = READ_CHUNKSIZE, queue_size: int = READ_QUEUE_SIZE, skip_rows: int = 0):
+    """Итератор по чанкам дампа, чтение и распаковка идут в фоновом потоке.
+
+    skip_rows - сколько строк данных пропустить с начала (для продолжения после сбоя).
+    """
+    chunks = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_chunks, args=(path, chunksize, skip_rows, chunks, stop), daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def run(input_file: str, output_file: str, matcher: TitleMatcher,
+        chunksize: int = READ_CHUNKSIZE, threshold: float = SIM_THRESHOLD, max_results: int = MAX_RESULTS) -> int:
+    """Фильтрует дамп и дописывает найденные вакансии в gzip по мере обработки"""
+    out_dir = os.path.dirname(output_file)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    total_count = 0
+    total_rows = 0
+    started = time.time()
+
+    with gzip.open(output_file, "wt", encoding="utf-8-sig", newline="") as out:
+        header = True
+        progress = tqdm(iter_chunks(input_file, chunksize), desc="Чтение чанков")
+        for chunk in progress:
+            total_rows += len(chunk)
+            filtered = process_chunk(chunk, matcher, threshold)
+            if filtered.empty:
+                continue
+
+            if max_results:
+                filtered = filtered.head(max_results - total_count)
+            filtered.to_csv(out, header=header, index=False)
+            header = False
+            total_count += len(filtered)
+            progress.set_postfix(found=total_count, encoded=matcher.encoded)
+
+            if max_results and total_count >= max_results:
+                break
+
+        if header:
+            pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(out, index=False)
+
+    elapsed = time.time() - started
+    stats = matcher.stats()
+    print(f"Прочитано {total_rows} строк за {elapsed:.0f}с, сохранено {total_count} строк в {output_file}")
+    print(f"Уникальных названий: {stats['cached_titles']}, закодировано: {stats['encoded']} из {stats['titles']}")
+    report_paths(stats)
+    if "embedding_cache" in stats:
+        cache_stats = stats["embedding_cache"]
+        print(f"Кэш эмбеддингов: {cache_stats['hits']} попаданий, {cache_stats['misses']} промахов")
+    return total_count
+
+
+def report_paths(stats: dict):
+    """Доли строк и уникальных названий, решённых каждым путём"""
+    names = {EXACT: "точное совпадение", AMBIGUOUS: "через модель"}
+    paths = stats["paths"]
+    total_rows = sum(p["rows"] for p in paths.values()) or 1
+    total_titles = sum(p["titles"] for p in paths.values()) or 1
+    for path, name in names.items():
+        rows, titles = paths[path]["rows"], paths[path]["titles"]
+        print(f"  {name}: {rows / total_rows:.1%} строк, {titles / total_titles:.1%} названий ({titles})")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Фильтрация вакансий по эталонному списку профессий")
+    parser.add_argument("--input", default=INPUT_FILE, help="дамп вакансий (.csv.bz2)")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="выходной .csv.gz")
+    parser.add_argument("--professions", default=PROFESSIONS_PATH, help="xlsx с колонкой 'профессия'")
+    parser.add_argument("--chunksize", type=int, default=READ_CHUNKSIZE)
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    parser.add_argument("--threshold", type=float, default=SIM_THRESHOLD)
+    parser.add_argument("--max-results", type=int, default=MAX_RESULTS, help="0 - без ограничения")
+    parser.add_argument("--backend", choices=BACKENDS, default=ENCODER_BACKEND, help="бэкенд модели")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать дисковый кэш эмбеддингов")
+    parser.add_argument("--no-lexical", action="store_true", help="отправлять все названия в модель")
+    return parser.parse_args()
+
+
+def create_matcher(professions_path: str = PROFESSIONS_PATH, batch_size: int = ENCODE_BATCH_SIZE,
+                   use_cache: bool = USE_EMBEDDING_CACHE, use_lexical: bool = USE_LEXICAL_INDEX,
+                   backend: str = ENCODER_BACKEND, threads: int = 0) -> TitleMatcher:
+    # Использовали лёгкую модель, так как очень много данных и могли себе позволить отбросить сложные нюансы.
+    encoder = make_encoder(MODEL_NAME, backend=backend, device=DEVICE, threads=threads)
+    professions = load_professions(professions_path)
+    # Векторы разных бэкендов не смешиваются: у каждого свой раздел кэша
+    embedding_cache = EmbeddingCache(encoder.cache_name, dtype=EMBEDDING_CACHE_DTYPE) if use_cache else None
+    lexical_index = LexicalIndex(professions) if use_lexical else None
+    return TitleMatcher(encoder, professions, batch_size=batch_size,
+                        embedding_cache=embedding_cache, lexical_index=lexical_index)
+
+
+def main():
+    args = parse_args()
+    matcher = create_matcher(args.professions, batch_size=args.batch_size, backend=args.backend,
+                             use_cache=USE_EMBEDDING_CACHE and not args.no_cache,
+                             use_lexical=USE_LEXICAL_INDEX and not args.no_lexical)
+    run(args.input, args.output, matcher,
+        chunksize=args.chunksize, threshold=args.threshold, max_results=args.max_results)
+
+
+if __name__ == "__main__":
+    main()
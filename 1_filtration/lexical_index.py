@@ -0,0 +1,32 @@
+"""Лексический индекс по списку профессий - быстрый путь перед эмбеддингами.
+
+При пороге сходства 0.95 почти все принятые вакансии совпадают с профессией
+текстуально. Индекс решает очевидные случаи без модели: точное совпадение
+строки без учёта регистра и повторных пробелов -> вакансия принимается (у
+модели такая строка даёт сходство 1.0). Остальные названия считаются
+неоднозначными и уходят на эмбеддинги.
+"""
+
+EXACT = "exact"
+AMBIGUOUS = "ambiguous"
+
+
+def normalize_title(title: str) -> str:
+    """Без учёта регистра и повторных пробелов; пунктуация значима ("c++" и "c#" - разные профессии)"""
+    return " ".join(title.casefold().split())
+
+
+class LexicalIndex:
+    """Точный хэш нормализованных профессий"""
+
+    def __init__(self, professions: list[str]):
+        self.exact: dict[str, int] = {}
+        for idx, profession in enumerate(professions):
+            self.exact.setdefault(normalize_title(profession), idx)
+
+    def lookup(self, title: str) -> tuple[str, int, float]:
+        """Возвращает (путь, индекс профессии, оценка) для одного названия"""
+        idx = self.exact.get(normalize_title(title))
+        if idx is not None:
+            return EXACT, idx, 1.0
+        return AMBIGUOUS, -1, 0.0
@@ -0,0 +1,203 @@
+"""Параллельная фильтрация нескольких дампов hh.ru с продолжением после сбоя.
+
+Каждый дамп - отдельный шард, шарды распределяются по пулу процессов. В каждом
+процессе одна модель и фиксированное число потоков torch. После каждого чанка
+шард дописывает найденные вакансии отдельным gzip-блоком и сохраняет чекпоинт:
+сколько строк входа обработано и до какого байта выходной файл корректен.
+При перезапуске недописанный хвост обрезается, а уже обработанные строки
+пропускаются. В конце шарды сливаются в filtered_vacancies.csv.gz.
+
+Запуск:
+    python run_filtration.py --inputs "../INPUT_DATA/hh_*.csv.bz2" --threads-per-worker 2
+"""
+import argparse
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import filtration
+from filtration import OUTPUT_COLUMNS, iter_chunks, process_chunk
+
+INPUT_GLOB = "../INPUT_DATA/hh_*.csv.bz2"
+SHARD_DIR = "results/shards"
+THREADS_PER_WORKER = 2
+
+_matcher = None
+
+
+def _init_worker(threads: int, professions_path: str, batch_size: int, use_cache: bool, use_lexical: bool,
+                 backend: str):
+    """Инициализация процесса пула: одна модель на процесс"""
+    global _matcher
+    import torch
+    torch.set_num_threads(threads)
+    _matcher = filtration.create_matcher(professions_path, batch_size=batch_size, use_cache=use_cache,
+                                         use_lexical=use_lexical, backend=backend, threads=threads)
+
+
+def shard_name(input_file: str) -> str:
+    name = os.path.basename(input_file)
+    for ext in (".bz2", ".gz", ".csv"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name
+
+
+def _shard_paths(input_file: str, shard_dir: str) -> tuple[str, str]:
+    name = shard_name(input_file)
+    return os.path.join(shard_dir, f"{name}.csv.gz"), os.path.join(shard_dir, f"{name}.ckpt.json")
+
+
+def load_checkpoint(input_file: str, ckpt_path: str) -> dict:
+    fresh = {"input": input_file, "input_size": os.path.getsize(input_file),
+             "rows_done": 0, "output_bytes": 0, "found": 0, "done": False}
+    if not os.path.exists(ckpt_path):
+        return fresh
+    with open(ckpt_path, "r", encoding="utf-8") as f:
+        ckpt = json.load(f)
+    if ckpt.get("input_size") != fresh["input_size"]:
+        print(f"Дамп {input_file} изменился, шард начинается заново")
+        return fresh
+    return ckpt
+
+
+def save_checkpoint(ckpt: dict, ckpt_path: str):
+    tmp_path = ckpt_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ckpt, f, ensure_ascii=False)
+    os.replace(tmp_path, ckpt_path)
+
+
+def process_shard(input_file: str, shard_dir: str, chunksize: int, threshold: float) -> dict:
+    """Обрабатывает один дамп в процессе пула, начиная с последнего чекпоинта"""
+    os.makedirs(shard_dir, exist_ok=True)
+    out_path, ckpt_path = _shard_paths(input_file, shard_dir)
+    ckpt = load_checkpoint(input_file, ckpt_path)
+    if ckpt["done"]:
+        return ckpt
+
+    started = time.time()
+    resumed_from = ckpt["rows_done"]
+    mode = "r+b" if os.path.exists(out_path) else "wb"
+    with open(out_path, mode) as out:
+        # Всё, что записано после последнего чекпоинта, обрабатывается заново
+        out.truncate(ckpt["output_bytes"])
+        out.seek(ckpt["output_bytes"])
+
+        for chunk in iter_chunks(input_file, chunksize, skip_rows=ckpt["rows_done"]):
+            filtered = process_chunk(chunk, _matcher, threshold)
+            if not filtered.empty:
+                # Каждый чанк - отдельный gzip-блок, склейка блоков остаётся корректным gzip
+                data = filtered.to_csv(header=False, index=False).encode("utf-8")
+                out.write(gzip.compress(data))
+                out.flush()
+                os.fsync(out.fileno())
+
+            ckpt["rows_done"] += len(chunk)
+            ckpt["found"] += len(filtered)
+            ckpt["output_bytes"] = out.tell()
+            save_checkpoint(ckpt, ckpt_path)
+
+    ckpt["done"] = True
+    save_checkpoint(ckpt, ckpt_path)
+    ckpt["elapsed"] = time.time() - started
+    ckpt["resumed_from"] = resumed_from
+    ckpt["stats"] = _matcher.stats()
+    return ckpt
+
+
+def merge_shards(input_files: list[str], shard_dir: str, output_file: str, chunksize: int = 100000) -> int:
+    """Сливает выходы шардов в один файл, убирая вакансии, повторяющиеся в разных дампах"""
+    out_dir = os.path.dirname(output_file)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    seen = set()
+    total = 0
+    tmp_path = output_file + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8-sig", newline="") as out:
+        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(out, index=False)
+        for input_file in input_files:
+            out_path, _ = _shard_paths(input_file, shard_dir)
+            if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+                continue
+            reader = pd.read_csv(out_path, header=None, names=OUTPUT_COLUMNS, dtype={"_id": str},
+                                 chunksize=chunksize, compression="gzip")
+            for chunk in reader:
+                chunk = chunk[~chunk["_id"].isin(seen) & ~chunk["_id"].duplicated()]
+                seen.update(chunk["_id"])
+                chunk.to_csv(out, header=False, index=False)
+                total += len(chunk)
+
+    os.replace(tmp_path, output_file)
+    print(f"Сведено {total} строк из {len(input_files)} шардов в {output_file}")
+    return total
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Параллельная фильтрация дампов вакансий с чекпоинтами")
+    parser.add_argument("--inputs", default=INPUT_GLOB, help="glob дампов (.csv.bz2)")
+    parser.add_argument("--output", default=filtration.OUTPUT_FILE)
+    parser.add_argument("--shard-dir", default=SHARD_DIR, help="выходы и чекпоинты шардов")
+    parser.add_argument("--professions", default=filtration.PROFESSIONS_PATH)
+    parser.add_argument("--threads-per-worker", type=int, default=THREADS_PER_WORKER)
+    parser.add_argument("--workers", type=int, default=0, help="0 - по числу ядер / потоков на процесс")
+    parser.add_argument("--chunksize", type=int, default=filtration.READ_CHUNKSIZE)
+    parser.add_argument("--batch-size", type=int, default=filtration.ENCODE_BATCH_SIZE)
+    parser.add_argument("--threshold", type=float, default=filtration.SIM_THRESHOLD)
+    parser.add_argument("--backend", choices=filtration.BACKENDS, default=filtration.ENCODER_BACKEND)
+    parser.add_argument("--no-cache", action="store_true", help="не использовать дисковый кэш эмбеддингов")
+    parser.add_argument("--no-lexical", action="store_true", help="отправлять все названия в модель")
+    parser.add_argument("--merge-only", action="store_true", help="только слить готовые шарды")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    input_files = sorted(glob.glob(args.inputs))
+    if not input_files:
+        raise FileNotFoundError(f"Не найдено дампов по шаблону {args.inputs}")
+    os.makedirs(args.shard_dir, exist_ok=True)
+
+    if not args.merge_only:
+        workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads_per_worker)
+        workers = min(workers, len(input_files))
+        print(f"Дампов: {len(input_files)}, процессов: {workers}, потоков на процесс: {args.threads_per_worker}")
+
+        initargs = (args.threads_per_worker, args.professions, args.batch_size,
+                    filtration.USE_EMBEDDING_CACHE and not args.no_cache,
+                    filtration.USE_LEXICAL_INDEX and not args.no_lexical, args.backend)
+        failed = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            futures = {pool.submit(process_shard, path, args.shard_dir, args.chunksize, args.threshold): path
+                       for path in input_files}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    ckpt = future.result()
+                except Exception as e:
+                    failed.append(path)
+                    print(f"Ошибка в шарде {path}: {e}")
+                    continue
+                if "elapsed" in ckpt:
+                    print(f"{path}: {ckpt['rows_done']} строк (с {ckpt['resumed_from']}), "
+                          f"найдено {ckpt['found']}, {ckpt['elapsed']:.0f}с")
+                else:
+                    print(f"{path}: уже обработан ранее, найдено {ckpt['found']}")
+
+        if failed:
+            print(f"Не завершено шардов: {len(failed)}, перезапустите скрипт - они продолжатся с чекпоинта")
+            return
+
+    merge_shards(input_files, args.shard_dir, args.output)
+
+
+if __name__ == "__main__":
+    main()
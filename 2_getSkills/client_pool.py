@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ведро токенов: rate единиц в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Через сколько секунд в ведре наберётся amount"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def refund(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class KeyState:
+    """Состояние одного API-ключа: лимиты, охлаждение после 3505 и счётчики"""
+
+    def __init__(self, name: str, client, requests_per_second: float, tokens_per_minute: float):
+        self.name = name
+        self.client = client
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.cooldown_until = 0.0
+        self.consecutive_throttles = 0
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self.errors = 0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def wait_time(self, tokens: float) -> float:
+        cooldown = max(0.0, self.cooldown_until - time.monotonic())
+        return max(cooldown, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+
+class ClientPool:
+    """Пул клиентов с раздельным учётом лимитов по каждому ключу.
+
+    acquire выбирает ключ, который может принять запрос прямо сейчас (при
+    равенстве - с наименьшим числом запросов в полёте), или ждёт ближайший.
+    Ключ, получивший 3505, уходит на охлаждение, которое растёт при повторах.
+    """
+
+    def __init__(self, clients: dict, requests_per_second: float, tokens_per_minute: float,
+                 cooldown_seconds: float, max_cooldown_seconds: float):
+        self.keys = [KeyState(name, client, requests_per_second, tokens_per_minute)
+                     for name, client in clients.items()]
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+
+    async def acquire(self, tokens: float) -> KeyState:
+        while True:
+            waits = [(key.wait_time(tokens), key.in_flight, i) for i, key in enumerate(self.keys)]
+            wait, _, i = min(waits)
+            if wait <= 0:
+                key = self.keys[i]
+                key.requests.consume(1)
+                key.tokens.consume(tokens)
+                key.in_flight += 1
+                return key
+            await asyncio.sleep(wait)
+
+    def report_success(self, key: KeyState, estimated_tokens: float, used_tokens: float | None = None):
+        key.in_flight -= 1
+        key.successes += 1
+        key.consecutive_throttles = 0
+        if used_tokens is not None:
+            # Оценку токенов заменяем фактическим расходом
+            difference = estimated_tokens - used_tokens
+            if difference > 0:
+                key.tokens.refund(difference)
+            else:
+                key.tokens.consume(-difference)
+
+    def report_throttled(self, key: KeyState):
+        key.in_flight -= 1
+        key.throttles += 1
+        key.consecutive_throttles += 1
+        cooldown = min(self.max_cooldown_seconds, self.cooldown_seconds * 2 ** (key.consecutive_throttles - 1))
+        key.cooldown_until = max(key.cooldown_until, time.monotonic() + cooldown)
+        print(f"[{key.name}] 3505, ключ на охлаждении {cooldown:.0f}s")
+
+    def report_error(self, key: KeyState):
+        key.in_flight -= 1
+        key.errors += 1
+
+    def release(self, key: KeyState):
+        """Запрос отменён до ответа - только освобождаем ключ"""
+        key.in_flight -= 1
+
+    def stats(self) -> list[dict]:
+        return [{"key": key.name, "healthy": key.healthy, "in_flight": key.in_flight,
+                 "successes": key.successes, "throttles": key.throttles, "errors": key.errors}
+                for key in self.keys]
+
+
+class AimdLimiter:
+    """Адаптивный предел одновременных запросов (additive increase, multiplicative decrease).
+
+    Предел растёт на increase после каждого окна из window запросов, если доля
+    успешных не ниже success_threshold, и умножается на decrease при 3505 -
+    не чаще раза в decrease_interval секунд, чтобы пачка отказов от одних и тех же
+    запросов не обрушила его до минимума.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, increase: float = 1.0, decrease: float = 0.5,
+                 window: int = 20, success_threshold: float = 0.95, decrease_interval: float = 5.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.success_threshold = success_threshold
+        self.decrease_interval = decrease_interval
+
+        self.in_flight = 0
+        self._window_total = 0
+        self._window_ok = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+    def _count(self, ok: bool):
+        self._window_total += 1
+        self._window_ok += ok
+        if self._window_total >= self.window:
+            if self._window_ok / self._window_total >= self.success_threshold:
+                self.limit = min(self.maximum, self.limit + self.increase)
+            self._window_total = self._window_ok = 0
+
+    def on_success(self):
+        self._count(True)
+
+    def on_error(self):
+        self._count(False)
+
+    def on_throttle(self):
+        self._count(False)
+        now = time.monotonic()
+        if now - self._last_decrease >= self.decrease_interval:
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self._window_total = self._window_ok = 0
+            print(f"Предел параллельности снижен до {int(self.limit)}")
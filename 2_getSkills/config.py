@@ -6,13 +6,64 @@ API_KEYS = [
 ]
 
 MODEL = "mistral-large-latest"
+# Адрес API; для отладки можно указать локальную заглушку: http://127.0.0.1:8089
+MISTRAL_SERVER_URL = os.getenv("MISTRAL_SERVER_URL")
 INPUT_CSV = "../1_filtration/results/filtered_vacancies.csv.gz"
-OUTPUT_TXT = "results/results.txt"
-PROCESSED_IDS = "results/processed_ids.txt"
+OUTPUT_JOURNAL = "results/results.jsonl"  # журнал результатов: {"_id", "h": [...], "s": [...]} в строке
+OUTPUT_TABLE = "results/skills.npz"  # колоночная таблица для следующих этапов, см. common/skill_table.py
+LEGACY_OUTPUT_TXT = "results/results.txt"  # старый формат "id | hard | soft", импортируется в таблицу
+PROCESSED_IDS = "results/processed_ids.txt"  # журнал обработанных ID
+PROCESSED_INDEX = "results/processed_ids.index.json"  # сжатый индекс журнала (.npy рядом)
+PROCESSED_COMPACT_EVERY = 200_000  # сжимать журнал, когда в памяти накопилось столько ID
+EXTRACTION_CACHE_PATH = "results/extraction_cache.jsonl"
+PROMPT_VERSION = 1  # увеличить при изменении промптов, чтобы не брать из кэша ответы на старые
+CURSOR_PATH = "results/cursor.json"  # позиция во входном CSV для продолжения после перезапуска
+CURSOR_SAVE_SECONDS = 5.0
+# Сокращение описаний перед промптом (preprocess.py); при изменении стоит проверить режимом ab
+REDUCE_DESCRIPTIONS = False  # включить после просмотра отчёта python preprocess.py ab
+BOILERPLATE_PATH = "results/boilerplate.npy"  # хэши типовых абзацев, строится python preprocess.py build
+BOILERPLATE_MIN_COUNT = 20  # абзац, встреченный во входном файле столько раз, считается типовым
+BOILERPLATE_MIN_CHARS = 30  # короткие строки (заголовки, "опыт от 1 года") не удаляются
+AB_SAMPLE_SIZE = 50
+AB_REPORT_PATH = "results/preprocess_ab.csv"
 HARD_PATH = "results/hard.txt"
 SOFT_PATH = "results/soft.txt"
 
-BATCH_SIZE = 25
-MAX_CONCURRENCY = 10
+BATCH_SIZE = 25  # строк CSV за одно чтение
+PACK_SIZE = 5  # вакансий в одном запросе, 1 - по одной вакансии на запрос
+PACK_TOKEN_BUDGET = 4000  # предел токенов описаний в одном запросе
+MAX_CONCURRENCY = 10  # число воркеров и потолок параллельных запросов
+MIN_CONCURRENCY = 2
+INITIAL_CONCURRENCY = 5
+QUEUE_SIZE = MAX_CONCURRENCY * 4  # сколько вакансий заранее читается в очередь
 RETRIES = 3
+CAPACITY_RETRY_DELAY = 2.0  # задержка повтора после 3505, ключ при этом охлаждается отдельно
+
+# HTTP-соединения: отдельный keep-alive пул на каждый ключ, таймауты в секундах
+HTTP_MAX_CONNECTIONS_PER_KEY = 200
+HTTP_KEEPALIVE_EXPIRY = 60.0
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_READ_TIMEOUT = 120.0  # ответ mistral-large на длинный промпт
+HTTP_POOL_TIMEOUT = 30.0  # ожидание свободного соединения в пуле
+
+# Лимиты одного ключа
+KEY_REQUESTS_PER_SECOND = 1.0
+KEY_TOKENS_PER_MINUTE = 500_000
+KEY_COOLDOWN_SECONDS = 5.0  # охлаждение после 3505, удваивается при повторах
+KEY_MAX_COOLDOWN_SECONDS = 120.0
+CHARS_PER_TOKEN = 3
+OUTPUT_TOKENS_ESTIMATE = 300
+# Запись результатов: пачка до WRITER_BATCH_SIZE записей, ожидание новых не дольше WRITER_LINGER_SECONDS,
+# fsync не чаще раза в WRITER_FSYNC_SECONDS (None - только при остановке)
+WRITER_BATCH_SIZE = 500
+WRITER_LINGER_SECONDS = 0.05
+WRITER_FSYNC_SECONDS = 5.0
 RESTART_INTERVAL_SECONDS = 15 * 60
+
+# Метрики: HTTP-эндпоинт в формате Prometheus (None - не запускать) и JSON-снимок в файл
+METRICS_PORT = 9108
+METRICS_SNAPSHOT_PATH = "results/metrics.json"
+METRICS_SNAPSHOT_SECONDS = 30.0
+METRICS_RATE_WINDOW_SECONDS = 300.0  # окно для "вакансий в минуту"
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)  # границы гистограммы времени запроса, с
+STORAGE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5)
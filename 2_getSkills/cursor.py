@@ -0,0 +1,97 @@
+import json
+import os
+import time
+
+from scheduler import Job
+
+
+class InputCursor:
+    """Позиция во входном CSV, до которой все вакансии уже обработаны.
+
+    Позиция сдвигается только за строки, результат которых записан, поэтому
+    после перезапуска чтение продолжается с неё, а не с начала файла. Строки,
+    на которых исчерпаны повторы, сохраняются отдельным списком (номер строки
+    и _id, без текста) и при следующем запуске перечитываются из входного
+    файла и отправляются заново. Если входной файл
+    изменился (размер или время изменения), курсор сбрасывается.
+    """
+
+    def __init__(self, path: str, input_file: str, save_interval: float):
+        self.path = path
+        self.input_file = input_file
+        self.save_interval = save_interval
+        self.load()
+
+    def _fingerprint(self) -> dict:
+        stat = os.stat(self.input_file)
+        return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+    def load(self):
+        """Читает сохранённую позицию, состояние прошлого запуска в памяти сбрасывается"""
+        self.row = 0
+        self.failed = {}
+        self.outstanding = set()
+        self.retrying = {}
+        self._last_save = time.monotonic()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("input") == self.input_file and state.get("fingerprint") == self._fingerprint():
+                self.row = state["row"]
+                self.failed = {item["row"]: item["_id"] for item in state["failed"]}
+            else:
+                print(f"Входной файл {self.input_file} изменился, чтение начнётся с начала")
+        self.next_row = self.row
+
+    def retry_rows(self) -> dict[int, str]:
+        """Строки (номер -> _id), не обработанные в прошлых запусках, для повторной постановки в очередь"""
+        rows = dict(sorted(self.failed.items()))
+        self.retrying.update(self.failed)
+        self.failed = {}
+        return rows
+
+    def issue(self, job: Job):
+        """Строка прочитана и поставлена в очередь"""
+        self.outstanding.add(job.row)
+        self.next_row = job.row + 1
+
+    def passed(self, row: int):
+        """Строка прочитана, но обрабатывать её не нужно"""
+        self.next_row = row + 1
+
+    def complete(self, job: Job):
+        """Результат вакансии записан"""
+        self.outstanding.discard(job.row)
+        self.retrying.pop(job.row, None)
+        self.maybe_save()
+
+    def fail(self, job: Job):
+        """Повторы исчерпаны - строка уходит в список для следующего запуска"""
+        if job.row in self.outstanding or job.row in self.retrying:
+            self.outstanding.discard(job.row)
+            self.retrying.pop(job.row, None)
+            self.failed[job.row] = job.job_id
+
+    @property
+    def position(self) -> int:
+        return min(self.outstanding) if self.outstanding else self.next_row
+
+    def save(self):
+        failed = {**self.retrying, **self.failed}
+        state = {
+            "input": self.input_file,
+            "fingerprint": self._fingerprint(),
+            "row": self.position,
+            "in_flight": sorted(self.outstanding),
+            "failed": [{"row": row, "_id": failed[row]} for row in sorted(failed)],
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def maybe_save(self):
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import html
+import json
+import os
+import re
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_description(text: str) -> str:
+    """Текст вакансии без HTML-разметки, сущностей и различий в пробелах и регистре"""
+    text = html.unescape(_TAG_RE.sub(" ", str(text)))
+    return _SPACE_RE.sub(" ", text).strip().lower()
+
+
+def make_key(text: str, model: str, prompt_version: int) -> str:
+    payload = f"{prompt_version}\x1f{model}\x1f{normalize_description(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Навыки, уже извлечённые из одинаковых описаний.
+
+    Ключ - sha256 от версии промпта, модели и нормализованного описания, так что
+    перепосты вакансии под другим _id не отправляются в API повторно, а смена
+    промпта или модели не подтягивает старые ответы. Хранится в JSONL-файле,
+    который только дописывается, поэтому переживает перезапуски.
+
+    Пока описание обрабатывается (claim ... release), одинаковые вакансии
+    ждут его результата, а не отправляют тот же текст параллельно.
+    """
+
+    def __init__(self, path: str, model: str, prompt_version: int):
+        self.path = path
+        self.model = model
+        self.prompt_version = prompt_version
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._missed = set()  # повторные попытки той же вакансии не считаются новыми промахами
+        self._pending = {}
+
+        dir = os.path.dirname(path)
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # недописанная строка после сбоя
+                    self.entries[entry["key"]] = (entry["h"], entry["s"])
+        self._file = None
+
+    def key(self, text: str) -> str:
+        return make_key(text, self.model, self.prompt_version)
+
+    async def get(self, text: str) -> tuple[list, list] | None:
+        key = self.key(text)
+        result = self.entries.get(key)
+        if result is None and key in self._pending:
+            result = await asyncio.shield(self._pending[key])
+        if result is None:
+            if key not in self._missed:
+                self._missed.add(key)
+                self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def claim(self, text: str):
+        """Отмечает, что описание отправлено в API"""
+        key = self.key(text)
+        if key not in self._pending:
+            self._pending[key] = asyncio.get_running_loop().create_future()
+
+    def release(self, text: str):
+        """Будит ожидающих: они получат результат или None, если обработка не удалась"""
+        key = self.key(text)
+        future = self._pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(self.entries.get(key))
+
+    def put(self, text: str, h_skills: list, s_skills: list):
+        key = self.key(text)
+        if key in self.entries:
+            return
+        self.entries[key] = (h_skills, s_skills)
+        self._missed.discard(key)
+        if self._file is None:  # открывается заново после close() при перезапуске main()
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"key": key, "h": h_skills, "s": s_skills}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> str:
+        return (f"Кэш извлечения: {len(self.entries)} описаний, попаданий {self.hits} из "
+                f"{self.hits + self.misses} ({self.hit_rate:.1%})")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
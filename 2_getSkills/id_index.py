@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+_MAX_DIGITS = 19  # длиннее не помещается в uint64
+
+
+class ProcessedIdIndex:
+    """Множество обработанных ID вакансий без загрузки всего списка в память.
+
+    processed_ids.txt остаётся журналом, в который дописываются ID. Уже сжатая
+    часть журнала хранится отсортированным массивом uint64 в .npy и открывается
+    через mmap, проверка - бинарный поиск. В памяти держатся только ID из хвоста
+    журнала после последнего сжатия и новые, а также редкие нечисловые ID.
+
+    Рядом лежит meta-файл (index_path): имя текущего .npy и до какого байта
+    журнал в него вошёл. Сжатие читает хвост журнала, сливает его с массивом в
+    новый файл следующего поколения и только потом переключает meta, поэтому
+    сбой на любом шаге оставляет прежнее состояние. При первом запуске без
+    индекса весь журнал сжимается сразу - так выполняется миграция со старого
+    формата.
+    """
+
+    def __init__(self, log_path: str, index_path: str, compact_every: int):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.compact_every = compact_every
+        self.base = np.zeros(0, dtype=np.uint64)
+        self.base_file = None
+        self.generation = 0
+        self.log_offset = 0
+        self.other = set()
+        self.delta = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.generation = meta["generation"]
+            self.log_offset = meta["log_offset"]
+            self.other = set(meta["other"])
+            self.base_file = meta["file"]
+            self.base = np.load(self._data_path(self.base_file), mmap_mode="r")
+        elif os.path.exists(log_path) and os.path.getsize(log_path):
+            # Миграция со старого формата: весь журнал сразу уходит в массив
+            self.compact()
+        self._read_tail()
+        # Длинный хвост после прерванного прогона сжимается сразу, а не ждёт первого maybe_compact
+        if len(self.delta) >= compact_every:
+            self.compact()
+
+    def _data_path(self, name: str) -> str:
+        return os.path.join(os.path.dirname(self.index_path), name)
+
+    def _read_log(self, offset: int) -> tuple[np.ndarray, set, int]:
+        """Числовые ID, прочие ID и конец последней полной строки журнала начиная с offset"""
+        if not os.path.exists(self.log_path):
+            return np.zeros(0, dtype=np.uint64), set(), offset
+        with open(self.log_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].lower().split()
+        numeric = [line for line in lines if line.isdigit() and len(line) <= _MAX_DIGITS]
+        other = set()
+        if len(numeric) < len(lines):
+            other = {line.decode("utf-8") for line in lines if not (line.isdigit() and len(line) <= _MAX_DIGITS)}
+        numbers = np.fromiter(map(int, numeric), dtype=np.uint64, count=len(numeric))
+        return numbers, other, offset + end
+
+    def _read_tail(self):
+        numbers, other, _ = self._read_log(self.log_offset)
+        self.delta.update(numbers.tolist())
+        self.other.update(other)
+
+    @staticmethod
+    def _parse(job_id) -> int | str:
+        key = str(job_id).strip().lower()
+        if key.isdigit() and len(key) <= _MAX_DIGITS:
+            return int(key)
+        return key
+
+    def __contains__(self, job_id) -> bool:
+        key = self._parse(job_id)
+        if isinstance(key, str):
+            return key in self.other
+        if key in self.delta:
+            return True
+        base = self.base
+        i = np.searchsorted(base, np.uint64(key))
+        return i < len(base) and int(base[i]) == key
+
+    def __len__(self) -> int:
+        # Приблизительно: ID из хвоста журнала, уже попавшие в массив, не вычитаются
+        return len(self.base) + len(self.delta) + len(self.other)
+
+    def add(self, job_id):
+        key = self._parse(job_id)
+        if isinstance(key, str):
+            self.other.add(key)
+        else:
+            self.delta.add(key)
+
+    def compact(self):
+        """Сливает хвост журнала с массивом в новое поколение .npy"""
+        with self._lock:
+            numbers, other, offset = self._read_log(self.log_offset)
+            merged = np.concatenate([self.base, numbers])
+            merged.sort()
+            if len(merged):
+                merged = merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+            other |= self.other
+            generation = self.generation + 1
+            name = f"{os.path.splitext(os.path.basename(self.index_path))[0]}.{generation}.npy"
+
+            tmp_path = self._data_path(name) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, merged)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._data_path(name))
+
+            meta = {"generation": generation, "file": name, "log_offset": offset, "other": sorted(other)}
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+
+            old_file = self.base_file
+            self.base = np.load(self._data_path(name), mmap_mode="r")
+            self.base_file = name
+            self.generation = generation
+            self.log_offset = offset
+            self.other |= other
+            self.delta.difference_update(numbers.tolist())
+
+        if old_file:
+            try:
+                os.remove(self._data_path(old_file))
+            except OSError:
+                pass  # на Windows файл может быть ещё открыт через mmap
+
+    def maybe_compact(self):
+        """Запускает сжатие в фоновом потоке, если в памяти накопилось много ID"""
+        if len(self.delta) < self.compact_every or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self.compact, daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """Дожидается фонового сжатия"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -4,104 +4,280 @@ import time
 import pandas as pd
 import json
 from config import *
-from mistral import call_mistral, ServiceTierCapacityExceeded
+from mistral import (call_mistral, close_clients, generate_pack_prompt, generate_skill_prompt,
+                     ServiceTierCapacityExceeded)
+from cursor import InputCursor
+from extraction_cache import ExtractionCache
+from metrics import metrics
+from preprocess import DescriptionReducer
+from scheduler import Job, JobScheduler, Pack, iter_packs
 from storage import SkillStorage
 
-sem = asyncio.Semaphore(MAX_CONCURRENCY)
 storage = SkillStorage()
+cache = ExtractionCache(EXTRACTION_CACHE_PATH, MODEL, PROMPT_VERSION)
+cursor = InputCursor(CURSOR_PATH, INPUT_CSV, CURSOR_SAVE_SECONDS)
+reducer = DescriptionReducer(BOILERPLATE_PATH) if REDUCE_DESCRIPTIONS else None
 
 
 class AllTasksCompleted(Exception):
     pass
 
 
-async def process_row(job_id: str, job_text: str):
-    async with sem:
-        if job_id in storage.processed_ids:
-            return
+def is_processed(job: Job) -> bool:
+    if job.job_id in storage.processed_ids:
+        cursor.complete(job)
+        return True
+    return False
 
-        attempt = 1
-        while attempt < RETRIES:
-            try:
-                print(f"[{job_id}] attempt #{attempt}")
-                result = await call_mistral(job_text)
-
-                if not result:
-                    wait = 1.5 * attempt * random.random()
-                    print(f"[{job_id}] no result, retry in {wait:.1f}s")
-                    await asyncio.sleep(wait)
-                    continue
-
-                try:
-                    parsed = json.loads(result)
-                    if not isinstance(parsed, list):
-                        raise ValueError("Response is not a list")
-
-                    h_skills, s_skills = [], []
-                    for item in parsed:
-                        skill = item.get("s", "").strip()
-                        typ = item.get("t", "").upper()
-                        if not skill or typ not in {"H", "S"}:
-                            continue
-
-                        await storage.add_skill(skill, typ)
-                        if typ == "H":
-                            h_skills.append(skill)
-                        else:
-                            s_skills.append(skill)
-
-                    await storage.save_job_result(job_id, h_skills, s_skills)
-                    print(f"[{job_id}] H={len(h_skills)} S={len(s_skills)}")
-                    return
-
-                except (json.JSONDecodeError, ValueError) as e:
-                    print(f"[{job_id}] JSON error: {e}")
-                    await asyncio.sleep(1)
-                    continue
-
-            except ServiceTierCapacityExceeded as e:
-                backoff = min(32, 2 ** (attempt * random.random()))
-                print(f"[{job_id}] capacity exceeded, waiting {backoff:.1f}s")
-                await asyncio.sleep(backoff)
-                continue
-
-        print(f"[{job_id}] failed after {RETRIES} retries")
 
+def on_failed(job: Job | Pack):
+    failed_jobs = job.jobs if isinstance(job, Pack) else [job]
+    metrics.inc("jobs_failed_total", len(failed_jobs))
+    for failed_job in failed_jobs:
+        cursor.fail(failed_job)
+
+
+def on_retry(job: Job | Pack, delay: float):
+    metrics.inc("retries_total", kind="pack" if isinstance(job, Pack) else "job")
+
+
+async def save_cached(job: Job) -> bool:
+    """Сохраняет результат из кэша, если такое описание уже обрабатывалось"""
+    cached = await cache.get(job.text)
+    if cached is None:
+        return False
+    h_skills, s_skills = cached
+    await storage.save_job_result(job.job_id, h_skills, s_skills)
+    cursor.complete(job)
+    metrics.job_completed("cache")
+    print(f"[{job.job_id}] from cache H={len(h_skills)} S={len(s_skills)}")
+    return True
+
+
+async def save_skills(job: Job, items: list):
+    """Разбирает ответ модели по одной вакансии и сохраняет навыки"""
+    job_id = job.job_id
+    h_skills, s_skills = [], []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        skill = str(item.get("s", "")).strip()
+        typ = str(item.get("t", "")).upper()
+        if not skill or typ not in {"H", "S"}:
+            continue
+
+        await storage.add_skill(skill, typ)
+        if typ == "H":
+            h_skills.append(skill)
+        else:
+            s_skills.append(skill)
+
+    cache.put(job.text, h_skills, s_skills)
+    await storage.save_job_result(job_id, h_skills, s_skills)
+    cursor.complete(job)
+    metrics.job_completed("api")
+    print(f"[{job_id}] H={len(h_skills)} S={len(s_skills)}")
+
+
+def capacity_backoff(job_id: str) -> float:
+    # Перегруженный ключ охлаждается в пуле, повтор уйдёт на другой ключ
+    backoff = CAPACITY_RETRY_DELAY * (0.5 + random.random())
+    print(f"[{job_id}] capacity exceeded, retry in {backoff:.1f}s")
+    return backoff
+
+
+async def process_pack(pack: Pack) -> float | list | None:
+    """Одна попытка для пачки. Вакансии без корректного ответа возвращаются отдельными задачами"""
+    jobs = [job for job in pack.jobs if not is_processed(job) and not await save_cached(job)]
+    if not jobs:
+        return None
+
+    for job in jobs:
+        cache.claim(job.text)
+    try:
+        return await extract_pack(pack, jobs)
+    finally:
+        for job in jobs:
+            cache.release(job.text)
+
+
+async def extract_pack(pack: Pack, jobs: list[Job]) -> float | list | None:
+    print(f"[{pack.job_id}] attempt #{pack.attempt}, {len(jobs)} vacancies")
+    try:
+        result = await call_mistral(generate_pack_prompt(jobs), answers=len(jobs))
+    except ServiceTierCapacityExceeded:
+        return capacity_backoff(pack.job_id)
+
+    if not result:
+        metrics.inc("failures_total", reason="empty_response")
+        if pack.attempt >= RETRIES:
+            print(f"[{pack.job_id}] no result, splitting into single requests")
+            return [Job(job.job_id, job.text, row=job.row) for job in jobs]
+        wait = 1.5 * pack.attempt * random.random()
+        print(f"[{pack.job_id}] no result, retry in {wait:.1f}s")
+        return wait
+
+    try:
+        parsed = json.loads(result)
+        if not isinstance(parsed, dict):
+            raise ValueError("Response is not an object")
+    except (json.JSONDecodeError, ValueError) as e:
+        metrics.inc("failures_total", reason="json_error")
+        print(f"[{pack.job_id}] JSON error: {e}, splitting into single requests")
+        return [Job(job.job_id, job.text, row=job.row) for job in jobs]
+
+    answers = {str(key).strip().lstrip("#").strip(): value for key, value in parsed.items()}
+    missing = []
+    for job in jobs:
+        items = answers.get(job.job_id)
+        if isinstance(items, list):
+            await save_skills(job, items)
+        else:
+            missing.append(Job(job.job_id, job.text, row=job.row))
+
+    if missing:
+        metrics.inc("failures_total", len(missing), reason="missing_answer")
+        print(f"[{pack.job_id}] no answer for {len(missing)} vacancies, retrying them one by one")
+        return missing
+    return None
 
-async def main():
-    df_iter = pd.read_csv(INPUT_CSV, dtype={"_id": str}, chunksize=BATCH_SIZE, encoding="utf-8-sig")
 
-    all_done = True
+async def process_row(job: Job | Pack) -> float | list | None:
+    """Одна попытка извлечения навыков. Возвращает задержку перед повтором или None, если готово"""
+    if isinstance(job, Pack):
+        return await process_pack(job)
 
-    for chunk in df_iter:
-        tasks = []
-        for _, row in chunk.iterrows():
-            jid = row["_id"]
+    if is_processed(job) or await save_cached(job):
+        return None
+
+    cache.claim(job.text)
+    try:
+        return await extract_single(job)
+    finally:
+        cache.release(job.text)
+
+
+async def extract_single(job: Job) -> float | None:
+    job_id = job.job_id
+    print(f"[{job_id}] attempt #{job.attempt}")
+    try:
+        result = await call_mistral(generate_skill_prompt(job.text))
+    except ServiceTierCapacityExceeded:
+        return capacity_backoff(job_id)
+
+    if not result:
+        metrics.inc("failures_total", reason="empty_response")
+        wait = 1.5 * job.attempt * random.random()
+        print(f"[{job_id}] no result, retry in {wait:.1f}s")
+        return wait
+
+    try:
+        parsed = json.loads(result)
+        if not isinstance(parsed, list):
+            raise ValueError("Response is not a list")
+    except (json.JSONDecodeError, ValueError) as e:
+        metrics.inc("failures_total", reason="json_error")
+        print(f"[{job_id}] JSON error: {e}")
+        return 1
+
+    await save_skills(job, parsed)
+    return None
+
+
+def read_input(start_row: int):
+    """Чанки входного CSV со строки данных start_row.
+
+    Пропуск задан числом строк, а не их списком: парсер не строит множество
+    номеров, а пропущенные строки не превращаются в DataFrame.
+    """
+    names = pd.read_csv(INPUT_CSV, nrows=0, encoding="utf-8-sig").columns.tolist()
+    return pd.read_csv(INPUT_CSV, dtype={"_id": str}, chunksize=BATCH_SIZE, encoding="utf-8-sig",
+                       header=None, names=names, skiprows=start_row + 1, usecols=["_id", "description"])
+
+
+def make_job(jid: str, text, row: int) -> Job:
+    # Сокращённое описание идёт и в промпт, и в ключ кэша, и в оценку размера пачки
+    return Job(jid, reducer.reduce(text) if reducer else text, row=row)
+
+
+def iter_retry_jobs():
+    """Вакансии, не обработанные в прошлых запусках: текст перечитывается из CSV по номерам строк"""
+    rows = cursor.retry_rows()
+    if not rows:
+        return
+    row, last = min(rows), max(rows)
+    for chunk in read_input(row):
+        for jid, text in zip(chunk["_id"], chunk["description"]):
+            if row in rows:
+                yield make_job(jid, text, row)
+            row += 1
+            if row > last:
+                return
+
+
+def iter_jobs():
+    """Отдаёт вакансии, не обработанные в прошлых запусках, затем лениво читает CSV с позиции курсора"""
+    yield from iter_retry_jobs()
+
+    row = cursor.row
+    for chunk in read_input(row):
+        for jid, text in zip(chunk["_id"], chunk["description"]):
             if jid in storage.processed_ids:
-                continue
-            tasks.append(asyncio.create_task(process_row(jid, row["description"])))
+                cursor.passed(row)
+            else:
+                job = make_job(jid, text, row)
+                cursor.issue(job)
+                yield job
+            row += 1
+
 
-        if tasks:
-            all_done = False
-            await asyncio.gather(*tasks)
+async def main():
+    cursor.load()
+    scheduler = JobScheduler(process_row, workers=MAX_CONCURRENCY, queue_size=QUEUE_SIZE, retries=RETRIES,
+                             on_failed=on_failed, on_retry=on_retry)
+    jobs = iter_jobs()
+    if PACK_SIZE > 1:
+        jobs = iter_packs(jobs, PACK_SIZE, PACK_TOKEN_BUDGET, lambda text: len(text) // CHARS_PER_TOKEN)
+    await storage.start()
+    try:
+        submitted = await scheduler.run(jobs)
+    finally:
+        # Дописываем всё, что успели получить, в том числе при перезапуске по таймауту
+        await storage.close()
+        cursor.save()
+        cache.close()
+        print(cache.report())
+        if reducer:
+            print(reducer.report())
+        print(f"Вакансий в минуту: {metrics.jobs_per_minute():.1f}")
 
-    if all_done:
+    if not submitted:
         raise AllTasksCompleted()
+    print(f"Обработано {scheduler.finished} задач (вакансий и пачек), не удалось: {scheduler.failed}")
 
 
 async def run_with_restart():
-    while True:
-        print(f"Запуск main() в {time.strftime('%H:%M:%S')}")
-        try:
-            await asyncio.wait_for(main(), timeout=RESTART_INTERVAL_SECONDS)
-        except AllTasksCompleted:
-            print("Все задачи выполнены, перезапуск не требуется")
-            break
-        except asyncio.TimeoutError:
-            print(f"{RESTART_INTERVAL_SECONDS // 60} минут прошло - перезапуск")
-        except Exception as e:
-            print(f"Ошибка в main: {e}")
-        await asyncio.sleep(5)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    snapshots = asyncio.create_task(metrics.write_snapshots(METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_SECONDS))
+    try:
+        while True:
+            print(f"Запуск main() в {time.strftime('%H:%M:%S')}")
+            try:
+                await asyncio.wait_for(main(), timeout=RESTART_INTERVAL_SECONDS)
+            except AllTasksCompleted:
+                print("Все задачи выполнены, перезапуск не требуется")
+                break
+            except asyncio.TimeoutError:
+                print(f"{RESTART_INTERVAL_SECONDS // 60} минут прошло - перезапуск")
+            except Exception as e:
+                print(f"Ошибка в main: {e}")
+            await asyncio.sleep(5)
+    finally:
+        snapshots.cancel()
+        metrics.write_snapshot(METRICS_SNAPSHOT_PATH)
+        metrics.shutdown()
+        await close_clients()
 
 
 if __name__ == "__main__":
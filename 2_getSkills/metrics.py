@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import LATENCY_BUCKETS, STORAGE_WAIT_BUCKETS, METRICS_RATE_WINDOW_SECONDS
+
+PREFIX = "skills_"
+REDUCTION_BUCKETS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как histogram в Prometheus"""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Оценка квантиля по корзинам: верхняя граница корзины, в которую он попал"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+def _labels_text(labels: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class RunMetrics:
+    """Метрики этапа извлечения навыков.
+
+    Счётчики и гистограммы с метками обновляются из цикла событий, показатели
+    (gauge) читаются функциями в момент выдачи. Всё отдаётся в текстовом
+    формате Prometheus по HTTP (GET /metrics, GET /metrics.json) и периодически
+    пишется JSON-снимком в файл. Обращения защищены блокировкой, потому что
+    HTTP-сервер работает в отдельном потоке.
+    """
+
+    def __init__(self, rate_window: float):
+        self.started = time.time()
+        self.rate_window = rate_window
+        self.counters = {}
+        self.histograms = {}
+        self.bucket_bounds = {}
+        self.gauges = {}
+        self.help = {}
+        self._completed = deque()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def describe(self, name: str, text: str, buckets=None):
+        self.help[name] = text
+        if buckets is not None:
+            self.bucket_bounds[name] = buckets
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.bucket_bounds.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def gauge(self, name: str, read):
+        """read() возвращает число или словарь {метка-значение: число} для метки key"""
+        self.gauges[name] = read
+
+    def job_completed(self, source: str):
+        """Результат вакансии записан; source - api или cache"""
+        self.inc("jobs_completed_total", source=source)
+        now = time.monotonic()
+        with self._lock:
+            self._completed.append(now)
+            while self._completed and now - self._completed[0] > self.rate_window:
+                self._completed.popleft()
+
+    def jobs_per_minute(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            while self._completed and now - self._completed[0] > self.rate_window:
+                self._completed.popleft()
+            window = min(self.rate_window, time.time() - self.started) or 1.0
+            return len(self._completed) * 60 / window
+
+    def _read_gauges(self) -> dict:
+        values = {"jobs_per_minute": self.jobs_per_minute(), "uptime_seconds": time.time() - self.started}
+        for name, read in self.gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                print(f"Метрика {name} недоступна: {e}")
+        return values
+
+    def render_prometheus(self) -> str:
+        gauges = self._read_gauges()
+        lines = []
+
+        def header(name, kind):
+            if name in self.help:
+                lines.append(f"# HELP {PREFIX}{name} {self.help[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = [(key, (list(h.buckets), list(h.counts), h.sum, h.count))
+                          for key, h in sorted(self.histograms.items(), key=lambda x: x[0])]
+
+        last = None
+        for (name, labels), value in counters:
+            if name != last:
+                header(name, "counter")
+                last = name
+            lines.append(f"{PREFIX}{name}{_labels_text(labels)} {value}")
+
+        last = None
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            if name != last:
+                header(name, "histogram")
+                last = name
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ["+Inf"], counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{PREFIX}{name}_bucket{_labels_text(labels, le)} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_labels_text(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{_labels_text(labels)} {count}")
+
+        for name, value in gauges.items():
+            header(name, "gauge")
+            if isinstance(value, dict):
+                for label, item in value.items():
+                    lines.append(f"{PREFIX}{name}{_labels_text((('key', label),))} {float(item)}")
+            else:
+                lines.append(f"{PREFIX}{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        gauges = self._read_gauges()
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), **histogram.snapshot()}
+                          for (name, labels), histogram in sorted(self.histograms.items(), key=lambda x: x[0])]
+        return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "gauges": gauges,
+                "counters": counters, "histograms": histograms}
+
+    def write_snapshot(self, path: str):
+        out_dir = os.path.dirname(path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    async def write_snapshots(self, path: str, interval: float):
+        """Фоновая задача: JSON-снимок раз в interval секунд"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.write_snapshot, path)
+            except Exception as e:
+                print(f"Ошибка записи метрик: {e}")
+
+    def serve(self, port: int):
+        """Запускает HTTP-сервер метрик в фоновом потоке"""
+        if self._server is not None:
+            return
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"Метрики: http://127.0.0.1:{port}/metrics")
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = RunMetrics(METRICS_RATE_WINDOW_SECONDS)
+metrics.describe("request_latency_seconds", "Время запроса к API по ключу и исходу")
+metrics.describe("key_wait_seconds", "Ожидание свободного слота параллельности и ключа перед запросом")
+metrics.describe("tokens_total", "Токены по ключу: prompt - вход, completion - выход")
+metrics.describe("failures_total", "Неудачные попытки по причине")
+metrics.describe("retries_total", "Повторы, поставленные в очередь планировщиком")
+metrics.describe("jobs_completed_total", "Вакансии с записанным результатом по источнику")
+metrics.describe("jobs_failed_total", "Вакансии, исчерпавшие повторы")
+metrics.describe("storage_wait_seconds", "Ожидание записи результата вакансии писателем", STORAGE_WAIT_BUCKETS)
+metrics.describe("writer_batch_seconds", "Время записи одной пачки на диск", STORAGE_WAIT_BUCKETS)
+metrics.describe("description_tokens_total", "Оценка токенов описаний до (original) и после (reduced) сокращения")
+metrics.describe("description_reduction_ratio", "Доля токенов описания, убранная сокращением", REDUCTION_BUCKETS)
+metrics.describe("jobs_per_minute", f"Вакансий в минуту за последние {METRICS_RATE_WINDOW_SECONDS:.0f} с")
@@ -1,17 +1,53 @@
 import asyncio
-from functools import partial
+import time
+import httpx
 from mistralai import Mistral
-import random
-from concurrent.futures import ThreadPoolExecutor
-from config import API_KEYS, MODEL, MAX_CONCURRENCY
+from client_pool import AimdLimiter, ClientPool
+from metrics import metrics
+from config import (API_KEYS, MODEL, MAX_CONCURRENCY, MIN_CONCURRENCY, INITIAL_CONCURRENCY, MISTRAL_SERVER_URL,
+                    KEY_REQUESTS_PER_SECOND, KEY_TOKENS_PER_MINUTE, KEY_COOLDOWN_SECONDS, KEY_MAX_COOLDOWN_SECONDS,
+                    CHARS_PER_TOKEN, OUTPUT_TOKENS_ESTIMATE, HTTP_MAX_CONNECTIONS_PER_KEY, HTTP_CONNECT_TIMEOUT,
+                    HTTP_READ_TIMEOUT, HTTP_POOL_TIMEOUT, HTTP_KEEPALIVE_EXPIRY)
 
 
 class ServiceTierCapacityExceeded(Exception):
     pass
 
 
-clients = [Mistral(api_key=k) for k in API_KEYS]
-executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY * 2)
+_http_clients = []
+
+
+def _make_client(api_key: str) -> Mistral:
+    """Клиент ключа со своим пулом keep-alive соединений"""
+    http_client = httpx.AsyncClient(
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS_PER_KEY,
+                            max_keepalive_connections=HTTP_MAX_CONNECTIONS_PER_KEY,
+                            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+    )
+    _http_clients.append(http_client)
+    # MISTRAL_SERVER_URL позволяет направить запросы на локальную заглушку (stub_server.py)
+    if MISTRAL_SERVER_URL:
+        return Mistral(api_key=api_key, server_url=MISTRAL_SERVER_URL, async_client=http_client)
+    return Mistral(api_key=api_key, async_client=http_client)
+
+
+async def close_clients():
+    for http_client in _http_clients:
+        await http_client.aclose()
+
+
+pool = ClientPool({f"key{i + 1}": _make_client(k) for i, k in enumerate(API_KEYS)},
+                  requests_per_second=KEY_REQUESTS_PER_SECOND,
+                  tokens_per_minute=KEY_TOKENS_PER_MINUTE,
+                  cooldown_seconds=KEY_COOLDOWN_SECONDS,
+                  max_cooldown_seconds=KEY_MAX_COOLDOWN_SECONDS)
+limiter = AimdLimiter(initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_CONCURRENCY)
+metrics.gauge("concurrency_limit", lambda: int(limiter.limit))
+metrics.gauge("requests_in_flight", lambda: limiter.in_flight)
+metrics.gauge("key_in_flight", lambda: {key.name: key.in_flight for key in pool.keys})
+metrics.gauge("key_healthy", lambda: {key.name: int(key.healthy) for key in pool.keys})
 
 
 def generate_skill_prompt(job_text: str) -> str:
@@ -31,36 +67,89 @@ def generate_skill_prompt(job_text: str) -> str:
     """
 
 
-def call_mistral_sync(job_text: str) -> str | None:
+def generate_pack_prompt(jobs: list) -> str:
+    vacancies = "\n\n".join(f"### {job.job_id}\n{job.text}" for job in jobs)
+    return f"""
+    Ты SkillExtractorAI — точный генератор JSON, который извлекает и классифицирует требуемые навыки из описаний вакансий.
+
+    Правила:
+    1. Извлекай ВСЕ навыки (hard skills - технические, soft skills - межличностные)
+    2. Приводи к стандартной форме
+    3. Не объединяй разные навыки
+    4. Обрабатывай каждую вакансию отдельно, навыки одной вакансии не переносить в другую
+
+    Формат вывода - объект, ключ - ID вакансии из заголовка "### ID":
+    {{"ID": [{{"s": "навык", "t": "H|S"}}, ...], ...}}
+
+    Вакансии:
+    {vacancies}
+    """
+
+
+def estimate_tokens(prompt: str, answers: int = 1) -> int:
+    """Грубая оценка расхода токенов на запрос - для ведра токенов ключа"""
+    return len(prompt) // CHARS_PER_TOKEN + OUTPUT_TOKENS_ESTIMATE * answers
+
+
+async def request_completion(client: Mistral, prompt: str) -> tuple[str | None, object]:
+    """Текст ответа и usage (prompt_tokens, completion_tokens, total_tokens) или None"""
     try:
-        client = random.choice(clients)
-        response = client.chat.complete(
+        response = await client.chat.complete_async(
             model=MODEL,
-            messages=[{"role": "user", "content": generate_skill_prompt(job_text)}],
+            messages=[{"role": "user", "content": prompt}],
             temperature=0.2,
             response_format={"type": "json_object"},
         )
-
-        content = response.choices[0].message.content
-        if not content:
-            return None
-
-        # Проверка на ошибки API
-        if hasattr(response, 'errors') and response.errors:
-            error = response.errors[0].get('code')
-            if '3505' in error.lower():
-                raise ServiceTierCapacityExceeded(error)
-
-        return content
-
     except Exception as e:
         error_msg = str(e)
         if '3505' in error_msg.lower():
             raise ServiceTierCapacityExceeded(error_msg)
-        print(error_msg)
-        return None
-
+        raise
+
+    # Проверка на ошибки API
+    if hasattr(response, 'errors') and response.errors:
+        error = response.errors[0].get('code')
+        if '3505' in error.lower():
+            raise ServiceTierCapacityExceeded(error)
+
+    content = response.choices[0].message.content
+    return content or None, getattr(response, 'usage', None)
+
+
+async def call_mistral(prompt: str, answers: int = 1) -> str | None:
+    """Отправляет готовый промпт; answers - сколько вакансий в нём, для оценки токенов ответа"""
+    estimated = estimate_tokens(prompt, answers)
+    queued = time.monotonic()
+
+    async with limiter:
+        key = await pool.acquire(estimated)
+        started = time.monotonic()
+        metrics.observe("key_wait_seconds", started - queued)
+        try:
+            content, usage = await request_completion(key.client, prompt)
+        except asyncio.CancelledError:
+            pool.release(key)
+            raise
+        except ServiceTierCapacityExceeded:
+            pool.report_throttled(key)
+            limiter.on_throttle()
+            metrics.observe("request_latency_seconds", time.monotonic() - started, key=key.name, outcome="throttled")
+            metrics.inc("failures_total", reason="capacity_exceeded")
+            raise
+        except Exception as e:
+            pool.report_error(key)
+            limiter.on_error()
+            metrics.observe("request_latency_seconds", time.monotonic() - started, key=key.name, outcome="error")
+            metrics.inc("failures_total", reason="api_error")
+            print(e)
+            return None
 
-async def call_mistral(job_text: str) -> str | None:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(executor, partial(call_mistral_sync, job_text))
+        metrics.observe("request_latency_seconds", time.monotonic() - started, key=key.name, outcome="ok")
+        used_tokens = getattr(usage, 'total_tokens', None)
+        for kind in ("prompt", "completion"):
+            tokens = getattr(usage, f"{kind}_tokens", None)
+            if tokens is not None:
+                metrics.inc("tokens_total", tokens, key=key.name, kind=kind)
+        pool.report_success(key, estimated, used_tokens)
+        limiter.on_success()
+        return content
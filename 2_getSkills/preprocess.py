@@ -0,0 +1,267 @@
+"""Сокращение описаний вакансий перед отправкой в модель.
+
+Из описания убирается разметка, типовые блоки, повторяющиеся в большом числе
+вакансий (описание компании, условия, контакты), и разделы, в которых навыков
+не бывает. Разделы с обязанностями и требованиями сохраняются целиком.
+
+Запуск:
+    python preprocess.py build        # частоты абзацев по входному CSV -> BOILERPLATE_PATH
+    python preprocess.py ab --sample 50   # сравнение навыков с сокращением и без на выборке
+"""
+import argparse
+import asyncio
+import hashlib
+import html
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from config import (INPUT_CSV, CHARS_PER_TOKEN, BOILERPLATE_PATH, BOILERPLATE_MIN_COUNT, BOILERPLATE_MIN_CHARS,
+                    AB_SAMPLE_SIZE, AB_REPORT_PATH)
+from metrics import metrics
+
+_BREAK_RE = re.compile(r"<\s*(br|/p|/li|li|/div|/h\d|/ul|/ol)[^>]*>", re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]+>")
+# Выделенный текст: <strong>, <b>, <h1>-<h6> (закрывающий </hN> уже заменён переводом строки)
+_MARKED_RE = re.compile(r"<\s*(strong|b|h\d)(?:\s[^>]*)?>(.*?)(?:<\s*/\s*\1\s*>|$)", re.IGNORECASE | re.DOTALL)
+_SPACE_RE = re.compile(r"[ \t\r\f\v\xa0]+")
+_BULLET_RE = re.compile(r"^[\s*•·\-–—]+")
+
+# Заголовки разделов; сначала проверяются разделы, которые сохраняются
+KEEP_HEADINGS = ("обязанност", "требовани", "задач", "ожидаем", "ждем", "ждём", "навык", "будет плюсом",
+                 "будет преимуществом", "что нужно", "что делать", "вам предстоит", "чем предстоит",
+                 "ты будешь", "вы будете", "квалификац", "знания", "компетенц", "функционал", "стек")
+# Отбрасываемые разделы узнаются только по началу заголовка: слово в середине строки
+# ("Холодные контакты с клиентами") - это обязанность, а не раздел
+DROP_HEADINGS = ("о компании", "о нас", "кто мы", "мы предлагаем", "что мы предлагаем", "предлагаем",
+                 "условия", "наши преимущества", "преимущества работы", "почему мы", "бонус", "льгот",
+                 "соцпакет", "контакт", "адрес", "график", "заработн", "зарплат", "оплата", "доход", "достоинств",
+                 "мы даем", "мы даём", "мы гарантируем")
+_HEADING_MAX_CHARS = 40
+
+
+def _clean(text: str) -> str:
+    return _SPACE_RE.sub(" ", html.unescape(_TAG_RE.sub(" ", text))).strip()
+
+
+def split_lines(text: str) -> list[tuple[str, bool]]:
+    """Строки описания без HTML-разметки и признак, что строка целиком выделена (жирный шрифт, заголовок)"""
+    lines = []
+    for part in _BREAK_RE.sub("\n", str(text)).split("\n"):
+        line = _clean(part)
+        if line and _BULLET_RE.sub("", line):
+            marked = _clean("".join(m.group(2) for m in _MARKED_RE.finditer(part)))
+            lines.append((line, marked == line))
+    return lines
+
+
+def strip_markup(text: str) -> list[str]:
+    """Строки описания без HTML-разметки и лишних пробелов"""
+    return [line for line, _ in split_lines(text)]
+
+
+def paragraph_hash(line: str) -> int:
+    """Хэш абзаца без маркера списка, регистра и пробелов - для подсчёта повторов"""
+    normalized = _BULLET_RE.sub("", line).lower().strip(" .;:,")
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def classify_heading(line: str, marked: bool = False) -> str | None:
+    """keep / drop / other для строки-заголовка, None - если строка не заголовок.
+
+    Заголовок - короткая строка без маркера списка, которая заканчивается
+    двоеточием ("Требования:") или целиком выделена разметкой
+    (<strong>Мы предлагаем</strong>). Разделы для сохранения узнаются по слову
+    в любом месте заголовка, отбрасываемые - только по началу.
+    """
+    if _BULLET_RE.match(line):
+        return None
+    text = line.lower().strip()
+    if not (marked or text.endswith(":")):
+        return None
+    head = text.rstrip(":!. ")
+    if len(head) > _HEADING_MAX_CHARS:
+        return None
+    if any(head.startswith(word) or f" {word}" in head for word in KEEP_HEADINGS):
+        return "keep"
+    if any(head.startswith(word) for word in DROP_HEADINGS):
+        return "drop"
+    return "other"
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+class DescriptionReducer:
+    """Сокращает описание вакансии перед построением промпта.
+
+    Описание делится на разделы по заголовкам. Разделы с обязанностями и
+    требованиями сохраняются целиком, разделы про компанию, условия и контакты
+    отбрасываются. Заголовок раздела - отдельная строка с двоеточием в конце
+    или выделенная разметкой, см. classify_heading. В остальных разделах (и в
+    тексте до первого заголовка) удаляются абзацы, встречающиеся во входном
+    файле не меньше BOILERPLATE_MIN_COUNT раз, - типовой текст работодателя. Если не осталось
+    ничего, отправляется описание без разметки.
+    """
+
+    def __init__(self, boilerplate_path: str | None = None):
+        self.boilerplate = np.zeros(0, dtype=np.uint64)
+        if boilerplate_path and os.path.exists(boilerplate_path):
+            self.boilerplate = np.load(boilerplate_path)
+        elif boilerplate_path:
+            print(f"{boilerplate_path} не найден, типовые абзацы не удаляются (python preprocess.py build)")
+        self.jobs = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def is_boilerplate(self, line: str) -> bool:
+        if len(line) < BOILERPLATE_MIN_CHARS or not len(self.boilerplate):
+            return False
+        key = np.uint64(paragraph_hash(line))
+        i = np.searchsorted(self.boilerplate, key)
+        return i < len(self.boilerplate) and self.boilerplate[i] == key
+
+    def reduce(self, text) -> str:
+        if not isinstance(text, str):
+            return text
+        sections = [["other", []]]
+        for line, marked in split_lines(text):
+            # Строка с текстом после двоеточия ("График работы: 5/2") - не заголовок и остаётся в своём разделе
+            kind = classify_heading(line, marked)
+            if kind is not None:
+                sections.append([kind, [line]])
+            else:
+                sections[-1][1].append(line)
+
+        lines = []
+        for kind, section in sections:
+            if kind == "drop":
+                continue
+            if kind == "keep":
+                lines.extend(section)
+            else:
+                lines.extend(line for line in section if not self.is_boilerplate(line))
+        reduced = "\n".join(lines) if lines else "\n".join(strip_markup(text))
+
+        before, after = estimate_tokens(text), estimate_tokens(reduced)
+        self.jobs += 1
+        self.tokens_before += before
+        self.tokens_after += after
+        metrics.inc("description_tokens_total", before, kind="original")
+        metrics.inc("description_tokens_total", after, kind="reduced")
+        if before:
+            metrics.observe("description_reduction_ratio", 1 - after / before)
+        return reduced
+
+    def report(self) -> str:
+        saved = self.tokens_before - self.tokens_after
+        share = saved / self.tokens_before if self.tokens_before else 0.0
+        return (f"Сокращение описаний: {self.jobs} вакансий, ~{self.tokens_before} -> ~{self.tokens_after} токенов "
+                f"(-{share:.1%}, в среднем -{saved / max(self.jobs, 1):.0f} на вакансию)")
+
+
+def build_boilerplate(input_csv: str, output_path: str, min_count: int, min_chars: int, chunksize: int = 20_000):
+    """Считает повторы абзацев по входному CSV и сохраняет хэши частых отсортированным массивом"""
+    values = np.zeros(0, dtype=np.uint64)
+    counts = np.zeros(0, dtype=np.int64)
+    rows = 0
+    for chunk in pd.read_csv(input_csv, usecols=["description"], chunksize=chunksize, encoding="utf-8-sig"):
+        hashes = []
+        for text in chunk["description"].dropna():
+            # Абзац, повторённый внутри одной вакансии, считается один раз
+            hashes.extend({paragraph_hash(line) for line in strip_markup(text) if len(line) >= min_chars})
+        rows += len(chunk)
+        chunk_values, chunk_counts = np.unique(np.array(hashes, dtype=np.uint64), return_counts=True)
+        merged = np.concatenate([values, chunk_values])
+        merged_counts = np.concatenate([counts, chunk_counts])
+        values, inverse = np.unique(merged, return_inverse=True)
+        counts = np.bincount(inverse, weights=merged_counts, minlength=len(values)).astype(np.int64)
+        print(f"Прочитано {rows} вакансий, различных абзацев: {len(values)}")
+
+    frequent = values[counts >= min_count]
+    out_dir = os.path.dirname(output_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, frequent)
+    os.replace(tmp_path, output_path)
+    print(f"Типовых абзацев (не меньше {min_count} повторов): {len(frequent)}, сохранено в {output_path}")
+
+
+def _parse_skills(result: str | None) -> set | None:
+    try:
+        parsed = json.loads(result) if result else None
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(parsed, list):
+        return None
+    return {(str(item.get("s", "")).strip().lower(), str(item.get("t", "")).upper())
+            for item in parsed if isinstance(item, dict) and str(item.get("s", "")).strip()}
+
+
+async def run_ab(sample_size: int, report_path: str):
+    """Извлекает навыки из исходных и сокращённых описаний выборки и сравнивает результаты"""
+    from mistral import call_mistral, close_clients, generate_skill_prompt
+
+    reducer = DescriptionReducer(BOILERPLATE_PATH)
+    pool = pd.read_csv(INPUT_CSV, dtype={"_id": str}, usecols=["_id", "description"], nrows=sample_size * 20,
+                       encoding="utf-8-sig").dropna()
+    sample = pool.sample(min(sample_size, len(pool)), random_state=0)
+
+    async def compare(job_id: str, text: str) -> dict:
+        reduced = reducer.reduce(text)
+        raw_result, reduced_result = await asyncio.gather(call_mistral(generate_skill_prompt(text)),
+                                                          call_mistral(generate_skill_prompt(reduced)))
+        raw, short = _parse_skills(raw_result), _parse_skills(reduced_result)
+        row = {"_id": job_id, "tokens_raw": estimate_tokens(text), "tokens_reduced": estimate_tokens(reduced)}
+        if raw is None or short is None:
+            return {**row, "error": True}
+        common = raw & short
+        return {**row, "error": False, "skills_raw": len(raw), "skills_reduced": len(short),
+                "recall": len(common) / len(raw) if raw else 1.0,
+                "jaccard": len(common) / len(raw | short) if raw | short else 1.0,
+                "lost": ";".join(sorted(skill for skill, _ in raw - short)),
+                "added": ";".join(sorted(skill for skill, _ in short - raw))}
+
+    try:
+        rows = await asyncio.gather(*(compare(job_id, text)
+                                      for job_id, text in zip(sample["_id"], sample["description"])))
+    finally:
+        await close_clients()
+
+    report = pd.DataFrame(rows)
+    out_dir = os.path.dirname(report_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    report.to_csv(report_path, index=False, encoding="utf-8-sig")
+
+    ok = report[~report["error"]]
+    print(reducer.report())
+    print(f"Сравнено {len(ok)} из {len(report)} вакансий (у остальных нет ответа в одном из вариантов)")
+    if len(ok):
+        print(f"Навыков в среднем: {ok['skills_raw'].mean():.1f} без сокращения, "
+              f"{ok['skills_reduced'].mean():.1f} с сокращением")
+        print(f"Полнота относительно исходного описания: {ok['recall'].mean():.1%}, "
+              f"Жаккар: {ok['jaccard'].mean():.1%}")
+    print(f"По вакансиям: {report_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сокращение описаний вакансий перед извлечением навыков")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="найти типовые абзацы во входном CSV")
+    build.add_argument("--min-count", type=int, default=BOILERPLATE_MIN_COUNT)
+    ab = commands.add_parser("ab", help="сравнить навыки с сокращением и без на выборке")
+    ab.add_argument("--sample", type=int, default=AB_SAMPLE_SIZE)
+    ab.add_argument("--report", default=AB_REPORT_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_boilerplate(INPUT_CSV, BOILERPLATE_PATH, args.min_count, BOILERPLATE_MIN_CHARS)
+    else:
+        asyncio.run(run_ab(args.sample, args.report))
@@ -0,0 +1,150 @@
+import asyncio
+
+
+class Job:
+    """Вакансия в очереди на извлечение навыков"""
+
+    __slots__ = ("job_id", "text", "attempt", "row")
+
+    def __init__(self, job_id: str, text: str, attempt: int = 1, row: int | None = None):
+        self.job_id = job_id
+        self.text = text
+        self.attempt = attempt
+        self.row = row
+
+
+class Pack:
+    """Несколько вакансий, отправляемых одним запросом"""
+
+    __slots__ = ("job_id", "jobs", "attempt")
+
+    def __init__(self, jobs: list[Job], attempt: int = 1):
+        self.job_id = f"pack:{jobs[0].job_id}+{len(jobs) - 1}"
+        self.jobs = jobs
+        self.attempt = attempt
+
+
+def iter_packs(jobs, pack_size: int, token_budget: int, estimate):
+    """Собирает подряд идущие вакансии в пачки не больше pack_size штук и token_budget токенов.
+
+    Вакансия, которая одна не влезает в бюджет, и пачка из одной вакансии
+    отдаются обычной задачей Job.
+    """
+    batch, tokens = [], 0
+    for job in jobs:
+        cost = estimate(job.text)
+        if batch and (len(batch) >= pack_size or tokens + cost > token_budget):
+            yield batch[0] if len(batch) == 1 else Pack(batch)
+            batch, tokens = [], 0
+        batch.append(job)
+        tokens += cost
+    if batch:
+        yield batch[0] if len(batch) == 1 else Pack(batch)
+
+
+class JobScheduler:
+    """Непрерывная очередь: каждый воркер берёт следующую вакансию, как только освободится.
+
+    handler(job) выполняет одну попытку и возвращает задержку перед повтором
+    или None, если вакансия обработана. Повтор кладётся обратно в очередь
+    после задержки и не занимает воркер на время ожидания. Если handler
+    вернул список задач, текущая считается выполненной, а задачи из списка
+    ставятся в очередь отдельно (так пачка возвращает вакансии без ответа).
+    on_failed(job) вызывается для задачи, исчерпавшей повторы, on_retry(job, delay) -
+    для каждого поставленного повтора.
+    """
+
+    def __init__(self, handler, workers: int, queue_size: int, retries: int, on_failed=None, on_retry=None):
+        self.handler = handler
+        self.on_failed = on_failed
+        self.on_retry = on_retry
+        self.workers = workers
+        self.retries = retries
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        self.submitted = 0
+        self.finished = 0
+        self.failed = 0
+        self._outstanding = 0
+        self._producer_done = False
+        self._all_done = asyncio.Event()
+        self._retry_tasks = set()
+
+    def _finish(self, job: Job, ok: bool):
+        self.finished += 1
+        if not ok:
+            self.failed += 1
+            print(f"[{job.job_id}] failed after {self.retries} retries")
+            if self.on_failed is not None:
+                self.on_failed(job)
+        self._outstanding -= 1
+        if self._producer_done and self._outstanding == 0:
+            self._all_done.set()
+
+    async def _requeue(self, job: Job, delay: float):
+        await asyncio.sleep(delay)
+        await self.queue.put(job)
+
+    def _schedule(self, job: Job, delay: float):
+        task = asyncio.create_task(self._requeue(job, delay))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    def _schedule_retry(self, job: Job, delay: float):
+        if self.on_retry is not None:
+            self.on_retry(job, delay)
+        job.attempt += 1
+        self._schedule(job, delay)
+
+    def _split(self, job: Job, jobs: list[Job]):
+        # Новые задачи учитываются до завершения текущей, иначе очередь может показаться пустой
+        for new_job in jobs:
+            self._outstanding += 1
+            self._schedule(new_job, 0)
+        self._finish(job, ok=True)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                try:
+                    delay = await self.handler(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[{job.job_id}] error: {e}")
+                    delay = 1.0
+
+                if delay is None:
+                    self._finish(job, ok=True)
+                elif isinstance(delay, list):
+                    self._split(job, delay)
+                elif job.attempt >= self.retries:
+                    self._finish(job, ok=False)
+                else:
+                    self._schedule_retry(job, delay)
+            finally:
+                self.queue.task_done()
+
+    async def _produce(self, jobs):
+        for job in jobs:
+            self._outstanding += 1
+            self.submitted += 1
+            await self.queue.put(job)
+
+        self._producer_done = True
+        if self._outstanding == 0:
+            self._all_done.set()
+
+    async def run(self, jobs) -> int:
+        """Обрабатывает вакансии из итератора jobs, возвращает число поставленных в очередь"""
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        producer = asyncio.create_task(self._produce(jobs))
+        try:
+            await producer
+            await self._all_done.wait()
+        finally:
+            for task in [producer, *workers, *self._retry_tasks]:
+                task.cancel()
+            await asyncio.gather(producer, *workers, *self._retry_tasks, return_exceptions=True)
+        return self.submitted
@@ -1,21 +1,46 @@
 import asyncio
-import aiofiles
+import json
+import sys
+import time
 
 from config import *
+from id_index import ProcessedIdIndex
+from metrics import metrics
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.skill_table import append_journal
+
+_STOP = object()
 
 
 class SkillStorage:
-    def __init__(self):
-        self.lock = asyncio.Lock()
-        self.processed_ids = self._load_set(PROCESSED_IDS)
-        self.hard_skills = self._load_set(HARD_PATH)
-        self.soft_skills = self._load_set(SOFT_PATH)
+    """Хранилище результатов с одним фоновым писателем.
+
+    add_skill и save_job_result только кладут записи в очередь. Писатель
+    держит файлы открытыми, забирает из очереди всё накопившееся (до
+    WRITER_BATCH_SIZE записей, подождав новые не дольше WRITER_LINGER_SECONDS)
+    и пишет пачкой: сначала навыки и строки журнала results.jsonl, затем ID
+    вакансий. Так ID попадает в processed_ids только после записи её навыков.
+    save_job_result возвращается, когда пачка с вакансией записана.
+    При остановке новые строки журнала дописываются в колоночную таблицу skills.npz.
+    """
 
-        for path in [PROCESSED_IDS, HARD_PATH, SOFT_PATH, OUTPUT_TXT]:
+    def __init__(self):
+        for path in [PROCESSED_IDS, PROCESSED_INDEX, HARD_PATH, SOFT_PATH, OUTPUT_JOURNAL, OUTPUT_TABLE]:
             dir = os.path.dirname(path)
             if dir and not os.path.exists(dir):
                 os.makedirs(dir, exist_ok=True)
 
+        self.processed_ids = ProcessedIdIndex(PROCESSED_IDS, PROCESSED_INDEX, PROCESSED_COMPACT_EVERY)
+        self.hard_skills = self._load_set(HARD_PATH)
+        self.soft_skills = self._load_set(SOFT_PATH)
+
+        self.queue = None
+        self._files = {}
+        self._writer = None
+        self._last_fsync = time.monotonic()
+        metrics.gauge("writer_queue_size", lambda: self.queue.qsize() if self.queue is not None else 0)
+
     @staticmethod
     def _load_set(path: str) -> set:
         if os.path.exists(path):
@@ -26,26 +51,122 @@ class SkillStorage:
                 print(f"Error loading {path}: {e}")
         return set()
 
+    async def start(self):
+        """Открывает файлы и запускает писателя"""
+        if self._writer is not None:
+            return
+        self.queue = asyncio.Queue()
+        self._files = {path: open(path, "a", encoding="utf-8")
+                       for path in (HARD_PATH, SOFT_PATH, OUTPUT_JOURNAL, PROCESSED_IDS)}
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def close(self):
+        """Дописывает всё из очереди, сбрасывает файлы на диск и закрывает их"""
+        if self._writer is None:
+            return
+        self.queue.put_nowait(_STOP)
+        await self._writer
+        self._writer = None
+        await asyncio.to_thread(self.processed_ids.wait)
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self._files = {}
+        await asyncio.to_thread(self.export_table)
+
+    @staticmethod
+    def export_table():
+        """Дописывает в skills.npz результаты, записанные в журнал с прошлого экспорта"""
+        table = append_journal(OUTPUT_TABLE, OUTPUT_JOURNAL, LEGACY_OUTPUT_TXT)
+        print(f"В {OUTPUT_TABLE} {len(table)} вакансий, {len(table.skills)} навыков")
+
     async def add_skill(self, skill: str, skill_type: str):
         """Добавляет навык в соответствующее хранилище, если его там нет"""
         skill_lower = skill.lower()
         target_set = self.hard_skills if skill_type == "H" else self.soft_skills
         target_path = HARD_PATH if skill_type == "H" else SOFT_PATH
 
-        async with self.lock:
-            if skill_lower not in target_set:
-                target_set.add(skill_lower)
-                async with aiofiles.open(target_path, "a", encoding="utf-8") as f:
-                    await f.write(f"{skill}\n")
+        if skill_lower not in target_set:
+            target_set.add(skill_lower)
+            self.queue.put_nowait((target_path, f"{skill}\n", None, None))
 
     async def save_job_result(self, job_id: str, h_skills: list, s_skills: list):
-        """Сохраняет результат обработки вакансии"""
-        async with self.lock:
-            if job_id not in self.processed_ids:
-                self.processed_ids.add(job_id)
-                async with aiofiles.open(PROCESSED_IDS, "a", encoding="utf-8") as f:
-                    await f.write(f"{job_id}\n")
-
-            async with aiofiles.open(OUTPUT_TXT, "a", encoding="utf-8") as f:
-                line = f"{job_id} | {';'.join(h_skills)} | {';'.join(s_skills)}\n"
-                await f.write(line)
+        """Сохраняет результат обработки вакансии и ждёт, пока он будет записан"""
+        line = json.dumps({"_id": job_id, "h": h_skills, "s": s_skills}, ensure_ascii=False) + "\n"
+        future = asyncio.get_running_loop().create_future()
+        queued = time.monotonic()
+        self.queue.put_nowait((OUTPUT_JOURNAL, line, job_id, future))
+        await future
+        metrics.observe("storage_wait_seconds", time.monotonic() - queued)
+
+    async def _collect(self) -> tuple[list, bool]:
+        """Пачка записей из очереди и признак остановки"""
+        item = await self.queue.get()
+        batch = []
+        deadline = time.monotonic() + WRITER_LINGER_SECONDS
+        while item is not _STOP:
+            batch.append(item)
+            if len(batch) >= WRITER_BATCH_SIZE:
+                return batch, False
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return batch, False
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    return batch, False
+        return batch, True
+
+    def _write(self, batch: list, new_ids: list, fsync: bool):
+        for path, text, _, _ in batch:
+            self._files[path].write(text)
+        data_files = [self._files[path] for path in (HARD_PATH, SOFT_PATH, OUTPUT_JOURNAL)]
+        for f in data_files:
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+        ids_file = self._files[PROCESSED_IDS]
+        ids_file.writelines(f"{job_id}\n" for job_id in new_ids)
+        ids_file.flush()
+        if fsync:
+            os.fsync(ids_file.fileno())
+
+    async def _write_loop(self):
+        stop = False
+        while not stop:
+            batch, stop = await self._collect()
+            if not batch:
+                continue
+
+            new_ids, seen = [], set()
+            for _, _, job_id, _ in batch:
+                if job_id is not None and job_id not in seen and job_id not in self.processed_ids:
+                    seen.add(job_id)
+                    new_ids.append(job_id)
+            fsync = WRITER_FSYNC_SECONDS is not None and time.monotonic() - self._last_fsync >= WRITER_FSYNC_SECONDS
+            error = None
+            started = time.monotonic()
+            try:
+                await asyncio.to_thread(self._write, batch, new_ids, fsync)
+                metrics.observe("writer_batch_seconds", time.monotonic() - started)
+                if fsync:
+                    self._last_fsync = time.monotonic()
+                for job_id in new_ids:
+                    self.processed_ids.add(job_id)
+                self.processed_ids.maybe_compact()
+            except Exception as e:
+                print(f"Ошибка записи результатов: {e}")
+                error = e
+
+            for _, _, _, future in batch:
+                if future is None or future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
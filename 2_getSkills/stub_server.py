@@ -0,0 +1,141 @@
+"""Локальная заглушка Mistral chat completions для настройки пула ключей без расхода квоты.
+
+Отвечает в формате API с искусственной задержкой, случайно или при превышении
+лимита ключа возвращает ошибку 3505 (429). На пакетный промпт отвечает
+объектом {_id: навыки} по заголовкам "### <_id>", на одиночный - списком
+навыков. Статистика - GET /stats.
+
+Запуск:
+    python stub_server.py --port 8089 --latency 2 --throttle-rate 0.05 --key-rps 1
+    MISTRAL_SERVER_URL=http://127.0.0.1:8089 python main.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from client_pool import TokenBucket
+
+CAPACITY_ERROR = {
+    "object": "error",
+    "message": "Service tier capacity exceeded for this model.",
+    "type": "service_tier_capacity_exceeded",
+    "param": None,
+    "code": "3505",
+}
+FAKE_SKILLS = [{"s": "Python", "t": "H"}, {"s": "SQL", "t": "H"}, {"s": "коммуникабельность", "t": "S"}]
+# Заголовок вакансии в пакетном промпте (generate_pack_prompt): "### <_id>"
+_PACK_HEADER_RE = re.compile(r"^\s*### (\S+)\s*$", re.MULTILINE)
+
+
+def fake_answer(prompt: str) -> str:
+    """Ответ на промпт: для пакета - объект {_id: навыки} по заголовкам вакансий, иначе список навыков"""
+    job_ids = _PACK_HEADER_RE.findall(prompt)
+    if job_ids:
+        return json.dumps({job_id: FAKE_SKILLS for job_id in dict.fromkeys(job_ids)}, ensure_ascii=False)
+    return json.dumps(FAKE_SKILLS, ensure_ascii=False)
+
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.counters = Counter()
+
+    def throttled(self, api_key: str) -> bool:
+        with self.lock:
+            if random.random() < self.args.throttle_rate:
+                return True
+            if not self.args.key_rps:
+                return False
+            bucket = self.buckets.setdefault(api_key, TokenBucket(self.args.key_rps, max(1.0, self.args.key_rps)))
+            if bucket.wait_time(1) > 0:
+                return True
+            bucket.consume(1)
+            return False
+
+    def count(self, name: str, api_key: str = ""):
+        with self.lock:
+            self.counters[name] += 1
+            if api_key:
+                self.counters[f"{name}:{api_key[-4:]}"] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, dict(self.state.counters))
+        else:
+            self._send(404, {"message": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        api_key = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        args = self.state.args
+
+        time.sleep(max(0.0, random.gauss(args.latency, args.jitter)))
+        if self.state.throttled(api_key):
+            self.state.count("throttled", api_key)
+            self._send(429, CAPACITY_ERROR)
+            return
+
+        self.state.count("ok", api_key)
+        prompt = "".join(m.get("content", "") for m in request.get("messages", []))
+        content = fake_answer(prompt)
+        self.state.count("packed" if content.startswith("{") else "single", api_key)
+        prompt_tokens = len(prompt) // 3
+        completion_tokens = len(content) // 3
+        self._send(200, {
+            "id": f"stub-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "model": request.get("model", "stub"),
+            "created": int(time.time()),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Заглушка Mistral API с задержками и ошибками 3505")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=2.0, help="средняя задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.5, help="разброс задержки, с")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля случайных ответов 3505")
+    parser.add_argument("--key-rps", type=float, default=0.0, help="лимит запросов в секунду на ключ, 0 - без лимита")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    StubHandler.state = StubState(args)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Заглушка Mistral на http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Статистика: {dict(StubHandler.state.counters)}")
+
+
+if __name__ == "__main__":
+    main()
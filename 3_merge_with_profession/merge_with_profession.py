@@ -1,36 +1,136 @@
+import csv
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 
-results = []
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.skill_table import SkillTable, SkillTableWriter, split_skills
+
+SKILLS_PATH = os.path.join("..", "2_getSkills", "results", "skills.npz")
+LEGACY_SKILLS_PATH = os.path.join("..", "2_getSkills", "results", "results.txt")
+VACANCIES_PATH = os.path.join("..", "1_filtration", "results", "filtered_vacancies.csv.gz")
+OUTPUT_FILE = "results/merged_skills.npz"
+LEGACY_OUTPUT_FILE = "results/merged_skills.csv"  # результат потоковой сводки из results.txt
+
+CHUNK_SIZE = 200_000  # строк вакансий, skills.npz и results.txt за одно чтение
+_MAX_DIGITS = 19  # длиннее не помещается в uint64
+
+
+def split_numeric(ids) -> tuple[np.ndarray, np.ndarray]:
+    """Маска числовых ID и сами они в uint64 (для нечисловых - 0)"""
+    ids = pd.Series(ids, dtype=object).astype(str).str.strip()
+    numeric = ids.str.fullmatch(rf"\d{{1,{_MAX_DIGITS}}}").to_numpy(dtype=bool)
+    values = np.zeros(len(ids), dtype=np.uint64)
+    values[numeric] = ids[numeric].to_numpy().astype(np.uint64)
+    return numeric, values
+
+
+class ProfessionMap:
+    """Компактное отображение _id вакансии -> код профессии.
+
+    Числовые ID хранятся отсортированным массивом uint64 с массивом int32-кодов
+    рядом, сами профессии - словарём. Редкие нечисловые ID лежат в обычном dict.
+    Строится по частям из filtered_vacancies, из файла читаются только _id и
+    best_profession - описания в память не попадают. При повторе ID берётся
+    первая профессия, как drop_duplicates (pd.merge раньше давал по строке на
+    каждую совпавшую профессию).
+    """
+
+    def __init__(self, ids: np.ndarray, codes: np.ndarray, professions: list[str], other: dict):
+        self.ids = ids
+        self.codes = codes
+        self.professions = professions
+        self.other = other
+
+    @classmethod
+    def read(cls, path: str, chunksize: int) -> "ProfessionMap":
+        index = {}
+        id_parts, code_parts, other = [], [], {}
+        reader = pd.read_csv(path, dtype={"_id": str}, usecols=["_id", "best_profession"], chunksize=chunksize,
+                             encoding="utf-8-sig")
+        for chunk in reader:
+            chunk = chunk.dropna()
+            categories = pd.Categorical(chunk["best_profession"])
+            remap = np.array([index.setdefault(p, len(index)) for p in categories.categories], dtype=np.int32)
+            codes = remap[categories.codes] if len(remap) else np.zeros(0, dtype=np.int32)
 
-with open(r"..\2_getSkills\results\results.txt", "r", encoding="utf-8", errors="replace") as f:
-    for line in f:
-        line = line.strip()
-        if not line or "|" not in line:
-            continue
+            numeric, values = split_numeric(chunk["_id"])
+            id_parts.append(values[numeric])
+            code_parts.append(codes[numeric])
+            for job_id, code in zip(chunk["_id"][~numeric], codes[~numeric]):
+                other.setdefault(str(job_id).strip(), int(code))
+        professions = [None] * len(index)
+        for profession, code in index.items():
+            professions[code] = profession
 
-        parts = line.split("|")
-        if len(parts) != 3:
-            continue
+        ids = np.concatenate([np.zeros(0, dtype=np.uint64)] + id_parts)
+        codes = np.concatenate([np.zeros(0, dtype=np.int32)] + code_parts)
+        order = np.argsort(ids, kind="stable")
+        ids, codes = ids[order], codes[order]
+        first = np.concatenate(([True], ids[1:] != ids[:-1])) if len(ids) else np.zeros(0, dtype=bool)
+        return cls(ids[first], codes[first], professions, other)
 
-        _id = parts[0].strip()
-        hard_skills = parts[1].strip()
-        soft_skills = parts[2].strip()
+    def lookup(self, ids) -> np.ndarray:
+        """Коды профессий для списка ID, -1 - вакансии нет в файле"""
+        numeric, values = split_numeric(ids)
+        result = np.full(len(values), -1, dtype=np.int32)
+        if len(self.ids):
+            positions = np.minimum(np.searchsorted(self.ids, values), len(self.ids) - 1)
+            found = numeric & (self.ids[positions] == values)
+            result[found] = self.codes[positions[found]]
+        for i in np.flatnonzero(~numeric):
+            result[i] = self.other.get(str(ids[i]).strip(), -1)
+        return result
 
-        results.append({
-            "_id": _id,
-            "hard_skills": hard_skills,
-            "soft_skills": soft_skills
-        })
 
-skills_df = pd.DataFrame(results)
+def merge_table(skills_path: str, profession_map: ProfessionMap, output_path: str, chunksize: int):
+    """Профессии в колоночную таблицу по частям skills.npz: на часть одна операция поиска по массиву ID"""
+    writer = SkillTableWriter(output_path)
+    meta = {}
+    for part in SkillTable.iter_load(skills_path, chunksize):
+        codes = profession_map.lookup(part.ids)
+        # В словаре остаются только профессии, встреченные у вакансий с навыками
+        known = codes >= 0
+        used, codes[known] = np.unique(codes[known], return_inverse=True)
+        professions = [profession_map.professions[code] for code in used.tolist()]
+        writer.append(part.with_profession_codes(professions, codes).take(known))
+        meta = part.meta
+    writer.close(meta)
+    print(f"Сведено {writer.rows} строк в {output_path}")
 
-vacancies_df = pd.read_csv(r"..\1_filtration\results\filtered_vacancies.csv.gz", dtype={"_id": str},
-                           encoding="utf-8-sig")
 
-vacancies_df["_id"] = vacancies_df["_id"].astype(str)
+def stream_legacy(results_path: str, profession_map: ProfessionMap, output_path: str, chunksize: int):
+    """Потоковая сводка старого results.txt в CSV: в памяти одна часть файла"""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    merged = 0
+    with open(results_path, "r", encoding="utf-8", errors="replace") as f_in, \
+            open(output_path, "w", encoding="utf-8-sig", newline="") as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(["_id", "best_profession", "hard_skills", "soft_skills"])
+        while True:
+            rows = []
+            for line in f_in:
+                parts = line.strip().split("|")
+                if len(parts) == 3:
+                    rows.append((parts[0].strip(), parts[1], parts[2]))
+                if len(rows) >= chunksize:
+                    break
+            if not rows:
+                break
+            codes = profession_map.lookup([job_id for job_id, _, _ in rows])
+            writer.writerows((job_id, profession_map.professions[code],
+                              ";".join(split_skills(hard)), ";".join(split_skills(soft)))
+                             for (job_id, hard, soft), code in zip(rows, codes.tolist()) if code >= 0)
+            merged += int((codes >= 0).sum())
+    print(f"Сведено {merged} строк в {output_path}")
 
-merged_df = pd.merge(vacancies_df[["_id", "best_profession"]], skills_df, on="_id", how="inner")
 
-merged_df.to_csv(r"results/merged_skills.csv", index=False, encoding="utf-8-sig")
+profession_map = ProfessionMap.read(VACANCIES_PATH, CHUNK_SIZE)
+print(f"Профессий: {len(profession_map.professions)}, вакансий: {len(profession_map.ids) + len(profession_map.other)}")
 
-print(f"Сведено {len(merged_df)} строк")
+if os.path.exists(SKILLS_PATH):
+    merge_table(SKILLS_PATH, profession_map, OUTPUT_FILE, CHUNK_SIZE)
+else:
+    stream_legacy(LEGACY_SKILLS_PATH, profession_map, LEGACY_OUTPUT_FILE, CHUNK_SIZE)
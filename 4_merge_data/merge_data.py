@@ -1,41 +1,197 @@
+import glob
+import os
+import re
+import sys
+
+import numpy as np
 import pandas as pd
 
-results_paths = [r"..\3_merge_with_profession\results\merged_skills.csv",
-                 r"..\3_merge_with_profession\results\merged_skills(1).csv"]
-soft_paths = [r"..\2_getSkills\results\soft.txt",
-              r"..\2_getSkills\results\soft(1).txt"]
-hard_paths = [r"..\2_getSkills\results\hard.txt",
-              r"..\2_getSkills\results\hard(1).txt"]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.skill_table import SkillTable, SkillTableWriter
+
+# Части результатов любых прогонов: .npz - merge_with_profession.py, .csv - выгрузки в старом формате
+RESULTS_GLOBS = [os.path.join("..", "3_merge_with_profession", "results", "merged_skills*.npz"),
+                 os.path.join("..", "3_merge_with_profession", "results", "merged_skills*.csv")]
+SOFT_GLOBS = [os.path.join("..", "2_getSkills", "results", "soft*.txt")]
+HARD_GLOBS = [os.path.join("..", "2_getSkills", "results", "hard*.txt")]
 
-result_out = "results/merged_skills_final.csv"
+result_out = "results/merged_skills_final.npz"
 soft_out = "results/soft_skills_final.txt"
 hard_out = "results/hard_skills_final.txt"
 
+KEEP = "first"  # какая из повторяющихся по _id вакансий остаётся: first - из более ранней части, last - из поздней
+MAX_IDS_IN_MEMORY = 5_000_000  # больше - новые ID сбрасываются на диск отдельным отсортированным файлом
+SPILL_DIR = "results/.spill"
+_MAX_DIGITS = 19  # длиннее не помещается в uint64
+
+
+def _natural_key(path: str) -> list:
+    """merged_skills, merged_skills(1), merged_skills(2), ..., merged_skills(10)"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", os.path.splitext(path)[0])]
+
+
+def expand(patterns: list[str]) -> list[str]:
+    """Файлы по шаблонам без повторов: шаблоны по порядку, внутри шаблона - файл без номера, затем (1), (2), ...
+
+    Порядок как в прежнем списке путей, он определяет, какая из повторяющихся вакансий остаётся.
+    """
+    paths = []
+    for pattern in patterns:
+        paths.extend(path for path in sorted(glob.glob(pattern), key=_natural_key) if path not in paths)
+    return paths
+
+
+def skip_stale_csv(paths: list[str]) -> list[str]:
+    """Без CSV, рядом с которыми есть .npz с тем же именем: это старый результат того же прогона"""
+    npz_stems = {os.path.splitext(path)[0] for path in paths if path.endswith(".npz")}
+    kept = []
+    for path in paths:
+        stem = os.path.splitext(path)[0]
+        if path.endswith(".csv") and stem in npz_stems:
+            print(f"Пропущен {path}: есть {stem}.npz")
+            continue
+        kept.append(path)
+    return kept
+
+
+class SeenIds:
+    """Множество уже взятых ID вакансий.
+
+    Числовые ID - отсортированные массивы uint64, проверка всей части сразу
+    через searchsorted. Новые ID копятся в памяти; когда их больше
+    MAX_IDS_IN_MEMORY, они сохраняются отдельным отсортированным файлом .npy и
+    дальше читаются через mmap, а в памяти начинается новый набор. Записанные
+    файлы не переписываются, так что каждый ID попадает на диск один раз.
+    Редкие нечисловые ID - обычный set.
+    """
+
+    def __init__(self, spill_dir: str, max_in_memory: int):
+        self.spill_dir = spill_dir
+        self.max_in_memory = max_in_memory
+        self.numeric = np.zeros(0, dtype=np.uint64)
+        self.runs = []
+        self.other = set()
+        self._paths = []
+
+    def __len__(self) -> int:
+        return len(self.numeric) + sum(len(run) for run in self.runs) + len(self.other)
+
+    @staticmethod
+    def _split(ids: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        ids = pd.Series(ids, dtype=object).astype(str).str.strip()
+        numeric = ids.str.fullmatch(rf"\d{{1,{_MAX_DIGITS}}}").to_numpy(dtype=bool)
+        values = np.zeros(len(ids), dtype=np.uint64)
+        values[numeric] = ids[numeric].to_numpy().astype(np.uint64)
+        return numeric, values
+
+    @staticmethod
+    def _isin(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+        if not len(sorted_values):
+            return np.zeros(len(values), dtype=bool)
+        positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+        return sorted_values[positions] == values
+
+    def contains(self, ids: list[str]) -> np.ndarray:
+        numeric, values = self._split(ids)
+        found = self._isin(self.numeric, values)
+        for run in self.runs:
+            found |= self._isin(run, values)
+        result = numeric & found
+        for i in np.flatnonzero(~numeric):
+            result[i] = str(ids[i]).strip() in self.other
+        return result
+
+    def add(self, ids: list[str]):
+        numeric, values = self._split(ids)
+        self.other.update(str(ids[i]).strip() for i in np.flatnonzero(~numeric))
+        merged = np.concatenate([self.numeric, values[numeric]])
+        merged.sort()
+        if len(merged):
+            merged = merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+        self.numeric = merged
+        if len(self.numeric) > self.max_in_memory:
+            self._spill()
+
+    def _spill(self):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"seen_ids.{len(self._paths)}.npy")
+        np.save(path, self.numeric)
+        self._paths.append(path)
+        self.runs.append(np.load(path, mmap_mode="r"))
+        self.numeric = np.zeros(0, dtype=np.uint64)
+
+    def cleanup(self):
+        self.numeric = np.zeros(0, dtype=np.uint64)
+        self.runs = []  # закрываем mmap до удаления файлов
+        for path in self._paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # на Windows файл может быть ещё открыт
+        self._paths = []
+        try:
+            os.rmdir(self.spill_dir)
+        except OSError:
+            pass
+
 
-def merge_files(file_paths, output_path):
-    merged_data = []
-    for path in file_paths:
-        with open(path, "r", encoding="utf-8") as f:
-            data = f.read().strip()
-            if data:
-                merged_data.append(data)
+def merge_tables(file_paths: list[str], output_path: str, keep: str = KEEP):
+    """Сводит части в одну таблицу, оставляя одну вакансию на _id.
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(merged_data))
-        print(f"Сведено в {output_path}")
+    Части читаются по одной; из каждой отбрасываются вакансии, уже взятые из
+    предыдущих, и повторы внутри самой части, остаток сразу дописывается в
+    выходной файл. Для keep="last" части сначала проходятся в обратном порядке,
+    чтобы найти остающиеся строки, и записываются вторым проходом в прямом.
+    """
+    if keep not in ("first", "last"):
+        raise ValueError(f"keep должен быть first или last, а не {keep}")
+    if not file_paths:
+        raise FileNotFoundError(f"Не найдено ни одной части результатов по шаблонам {RESULTS_GLOBS}")
+    seen = SeenIds(SPILL_DIR, MAX_IDS_IN_MEMORY)
+    writer = SkillTableWriter(output_path)
+    masks = {}
+    total = 0
+    for path in (file_paths if keep == "first" else file_paths[::-1]):
+        table = SkillTable.read(path)
+        total += len(table)
+        fresh = ~seen.contains(table.ids)
+        fresh &= ~pd.Series(table.ids, dtype=object).duplicated(keep=keep).to_numpy()
+        table = table.take(fresh)
+        seen.add(table.ids)
+        if keep == "first":
+            writer.append(table)
+        else:
+            masks[path] = fresh
+        print(f"{path}: {len(table)} новых вакансий, всего {len(seen)}")
+    seen.cleanup()
 
+    for path in (file_paths if keep == "last" else []):
+        writer.append(SkillTable.read(path).take(masks[path]))
+    writer.close()
+    print(f"Сведено {writer.rows} строк из {total} в {output_path}")
 
-def merge_csv_files(file_paths, output_path):
-    merged_df = pd.DataFrame()
-    for path in file_paths:
-        df = pd.read_csv(path, dtype={"_id": str}, encoding="utf-8-sig")
-        merged_df = pd.concat([merged_df, df], ignore_index=True)
 
-    merged_df.drop_duplicates(subset="_id", inplace=True)
-    merged_df.to_csv(output_path, index=False, encoding="utf-8-sig")
-    print(f"Сведено {len(merged_df)} строк в {output_path}")
+def merge_vocabulary(file_paths: list[str], output_path: str):
+    """Словарь навыков без повторов с точностью до регистра; остаётся первое написание"""
+    if not file_paths:
+        raise FileNotFoundError(f"Не найдено ни одного словаря навыков для {output_path}")
+    seen = set()
+    written = 0
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f_out:
+        for path in file_paths:
+            with open(path, "r", encoding="utf-8") as f_in:
+                for line in f_in:
+                    skill = line.strip()
+                    key = skill.casefold()
+                    if skill and key not in seen:
+                        seen.add(key)
+                        f_out.write(skill + "\n")
+                        written += 1
+    print(f"Сведено {written} навыков из {len(file_paths)} файлов в {output_path}")
 
 
-merge_csv_files(results_paths, result_out)
-merge_files(soft_paths, soft_out)
-merge_files(hard_paths, hard_out)
+if __name__ == "__main__":
+    merge_tables(skip_stale_csv(expand(RESULTS_GLOBS)), result_out)
+    merge_vocabulary(expand(SOFT_GLOBS), soft_out)
+    merge_vocabulary(expand(HARD_GLOBS), hard_out)
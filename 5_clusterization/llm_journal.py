@@ -0,0 +1,142 @@
+"""Упаковка кластеров в запросы к LLM и журнал ответов для cluster_skills_llm.
+
+Кластеры упаковываются в запросы по оценке токенов, а не по 10 штук:
+большие кластеры идут с маленькими, кластер больше бюджета делится на части
+(ключ "id#часть/всего"), группы частей потом склеиваются.
+
+Ответы дописываются строками в llm{step}{type}.jsonl рядом с JSON-файлом,
+поэтому запись одного ответа не зависит от числа уже полученных. В конце
+журнал сводится в llm{step}{type}.json прежнего формата и удаляется. При
+повторном запуске готовыми считаются ключи и из JSON, и из журнала.
+
+Пример:
+    journal = LlmJournal("results/0/llm0hard.json")
+    done = journal.load()
+    for request in pack_requests(clusters, done):
+        journal.append(send(request))
+    journal.compact()
+"""
+import json
+import os
+import threading
+
+CHARS_PER_TOKEN = 3
+MAX_REQUEST_TOKENS = 4000  # навыки одного запроса; ответ повторяет их с именами групп, так что выход больше
+MAX_CLUSTERS_PER_REQUEST = 50
+_PART_SEPARATOR = "#"
+
+
+def estimate_tokens(phrases: list[str]) -> int:
+    return len(json.dumps(phrases, ensure_ascii=False)) // CHARS_PER_TOKEN + 1
+
+
+def _split(cid: str, phrases: list[str], max_tokens: int) -> list[tuple[str, list[str]]]:
+    """Кластер больше бюджета -> части с ключами id#k/n"""
+    parts, current, tokens = [], [], 0
+    for phrase in phrases:
+        cost = estimate_tokens([phrase])
+        if current and tokens + cost > max_tokens:
+            parts.append(current)
+            current, tokens = [], 0
+        current.append(phrase)
+        tokens += cost
+    parts.append(current)
+    if len(parts) == 1:
+        return [(cid, phrases)]
+    return [(f"{cid}{_PART_SEPARATOR}{k}/{len(parts)}", part) for k, part in enumerate(parts)]
+
+
+def pack_requests(clusters: dict[str, list[str]], done: dict, max_tokens: int = MAX_REQUEST_TOKENS,
+                  max_clusters: int = MAX_CLUSTERS_PER_REQUEST) -> list[dict[str, list[str]]]:
+    """Неготовые кластеры -> запросы {ключ: навыки} в пределах max_tokens.
+
+    Самый большой из оставшихся кластеров дополняется самыми маленькими, пока
+    запрос помещается в бюджет.
+    """
+    items = []
+    for cid, phrases in clusters.items():
+        if cid in done:
+            continue
+        for key, part in _split(cid, phrases, max_tokens):
+            if key not in done:
+                items.append((estimate_tokens(part), key, part))
+    items.sort(key=lambda item: item[0], reverse=True)
+
+    requests = []
+    small = len(items) - 1
+    large = 0
+    while large <= small:
+        tokens, key, part = items[large]
+        request = {key: part}
+        large += 1
+        while large <= small and len(request) < max_clusters and tokens + items[small][0] <= max_tokens:
+            tokens += items[small][0]
+            request[items[small][1]] = items[small][2]
+            small -= 1
+        requests.append(request)
+    return requests
+
+
+class LlmJournal:
+    """Результаты группировки: сводный JSON плюс дописываемый журнал JSONL"""
+
+    def __init__(self, json_path: str):
+        self.json_path = json_path
+        self.journal_path = os.path.splitext(json_path)[0] + ".jsonl"
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """Готовые ключи и их группы; недописанная последняя строка журнала пропускается"""
+        self.results = {}
+        if os.path.exists(self.json_path):
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                self.results.update(json.load(f))
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.results[entry["key"]] = entry["groups"]
+        return self.results
+
+    def append(self, results: dict):
+        """Дописывает ответы (ключ -> группы или None при ошибке); вызывается из нескольких потоков"""
+        lines = "".join(json.dumps({"key": str(key), "groups": groups}, ensure_ascii=False) + "\n"
+                        for key, groups in results.items())
+        with self._lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+            self.results.update((str(key), groups) for key, groups in results.items())
+
+    def compact(self) -> dict:
+        """Сводит журнал в JSON: части кластера склеиваются, когда получены все"""
+        merged, parts = {}, {}
+        for key, groups in self.results.items():
+            if _PART_SEPARATOR in key:
+                cid, part = key.split(_PART_SEPARATOR, 1)
+                parts.setdefault(cid, {})[part] = groups
+            else:
+                merged[key] = groups
+        for cid, received in parts.items():
+            total = int(next(iter(received)).split("/")[1])
+            if len(received) < total:
+                merged.update((f"{cid}{_PART_SEPARATOR}{part}", groups) for part, groups in received.items())
+                continue
+            groups = [group for part_groups in received.values() if part_groups for group in part_groups]
+            merged[cid] = groups if any(part_groups is not None for part_groups in received.values()) else None
+
+        out_dir = os.path.dirname(self.json_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        tmp_path = self.json_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.json_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.results = merged
+        return merged
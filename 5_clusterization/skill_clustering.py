@@ -0,0 +1,315 @@
+"""Кластеризация навыков по графу соседей - замена DBSCAN(metric='cosine') из sklearn.
+
+Полный DBSCAN по косинусу считает расстояния от каждой фразы до всех
+остальных и держит в памяти списки соседей в обе стороны, поэтому на сотнях
+тысяч навыков не укладывается ни по времени, ни по памяти. Здесь:
+    1. строится граф пар с косинусным расстоянием не больше eps - блочным
+       умножением нормализованной матрицы на себя (только верхний треугольник,
+       блок ограничен BLOCK_BYTES) или приближённым поиском по индексу faiss;
+    2. по графу выполняется разметка DBSCAN: точка с не меньше чем min_samples
+       соседями (считая её саму) - ядро, кластеры - компоненты связности ядер,
+       граничная точка присоединяется к кластеру соседнего ядра, остальные - шум (-1).
+
+Результат совпадает с DBSCAN с точностью до выбора кластера для граничной
+точки, достижимой из нескольких кластеров (sklearn берёт первый по порядку
+обхода, здесь - кластер ядра с наименьшим номером). Номера кластеров идут в
+порядке первого ядра кластера, как у sklearn.
+
+Для ежедневных обновлений словаря есть CanonicalIndex: группы навыков с
+каноническими именами и центроидами после полного прогона. Новый навык
+присоединяется к ближайшей группе, если центроид в радиусе eps, и только
+оставшиеся кластеризуются заново и уходят в LLM.
+
+Пример:
+    labels = cluster_vectors(vectors, eps=0.4, min_samples=2)
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.skill_table import pack_strings, unpack_strings
+
+BACKENDS = ("blocked", "faiss")
+# Память под один блок произведения (строки блока x все фразы, float32)
+BLOCK_BYTES = 256 * 1024 ** 2
+# faiss: число ячеек IVF ~ FAISS_CELLS_PER_SQRT * sqrt(n), просматривается FAISS_NPROBE ближайших
+FAISS_CELLS_PER_SQRT = 4
+FAISS_NPROBE = 16
+FAISS_MIN_SIZE = 10_000  # на меньших наборах индекс не окупается, используется blocked
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+def blocked_pairs(vectors: np.ndarray, eps: float, block_bytes: int = BLOCK_BYTES) -> tuple[np.ndarray, np.ndarray]:
+    """Все пары i < j с косинусным расстоянием не больше eps: точный перебор блоками строк"""
+    n = len(vectors)
+    threshold = np.float32(1.0 - eps)
+    block = max(1, block_bytes // (4 * max(n, 1)))
+    rows, cols = [], []
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        # Произведение только с фразами начиная с блока: пары ниже диагонали уже найдены
+        sims = vectors[start:stop] @ vectors[start:].T
+        i, j = np.nonzero(sims >= threshold)
+        keep = j > i
+        rows.append((i[keep] + start).astype(np.int32))
+        cols.append((j[keep] + start).astype(np.int32))
+    empty = np.zeros(0, dtype=np.int32)
+    return np.concatenate([empty] + rows), np.concatenate([empty] + cols)
+
+
+def faiss_pairs(vectors: np.ndarray, eps: float, nprobe: int = FAISS_NPROBE,
+                batch_size: int = 4096) -> tuple[np.ndarray, np.ndarray]:
+    """Пары i < j в радиусе eps по индексу IVF faiss: быстрее, но часть пар может быть пропущена"""
+    try:
+        import faiss
+    except ImportError:
+        raise ImportError("Для backend='faiss' нужен пакет faiss-cpu (pip install faiss-cpu)")
+
+    n, dim = vectors.shape
+    # faiss нужно не меньше 39 точек на ячейку для обучения
+    cells = max(1, min(int(FAISS_CELLS_PER_SQRT * np.sqrt(n)), n // 39))
+    quantizer = faiss.IndexFlatIP(dim)
+    index = faiss.IndexIVFFlat(quantizer, dim, cells, faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors)
+    index.add(vectors)
+    index.nprobe = min(nprobe, cells)
+
+    rows, cols = [], []
+    for start in range(0, n, batch_size):
+        lims, _, found = index.range_search(vectors[start:start + batch_size], float(1.0 - eps))
+        i = np.repeat(np.arange(start, start + len(lims) - 1), np.diff(lims).astype(np.int64))
+        keep = found != i
+        # Поиск приближённый: пара может найтись только с одной стороны, поэтому берутся обе
+        rows.append(np.minimum(i[keep], found[keep]))
+        cols.append(np.maximum(i[keep], found[keep]))
+    empty = np.zeros(0, dtype=np.int64)
+    pairs = np.unique(np.concatenate([empty] + rows) * n + np.concatenate([empty] + cols))
+    return (pairs // n).astype(np.int32), (pairs % n).astype(np.int32)
+
+
+def dbscan_labels(n: int, rows: np.ndarray, cols: np.ndarray, min_samples: int) -> np.ndarray:
+    """Разметка DBSCAN по списку пар соседей (каждая пара один раз)"""
+    labels = np.full(n, -1, dtype=np.int64)
+    degree = np.bincount(rows, minlength=n) + np.bincount(cols, minlength=n) + 1
+    core = degree >= min_samples
+    if not core.any():
+        return labels
+
+    both = core[rows] & core[cols]
+    graph = coo_matrix((np.ones(int(both.sum()), dtype=np.int8), (rows[both], cols[both])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+    # Номера 0..k-1 в порядке первого ядра кластера, как при обходе sklearn
+    _, first_core, inverse = np.unique(components[core], return_index=True, return_inverse=True)
+    labels[core] = np.argsort(np.argsort(first_core))[inverse]
+
+    # Граничные точки: кластер соседнего ядра с наименьшим номером
+    border_to_core = np.concatenate([np.stack([rows, cols], 1)[core[cols] & ~core[rows]],
+                                     np.stack([cols, rows], 1)[core[rows] & ~core[cols]]])
+    if len(border_to_core):
+        border_to_core = border_to_core[np.lexsort((border_to_core[:, 1], border_to_core[:, 0]))]
+        first = np.concatenate(([True], border_to_core[1:, 0] != border_to_core[:-1, 0]))
+        labels[border_to_core[first, 0]] = labels[border_to_core[first, 1]]
+    return labels
+
+
+def cluster_vectors(vectors: np.ndarray, eps: float = 0.3, min_samples: int = 2,
+                    backend: str = "blocked") -> np.ndarray:
+    """Метки кластеров как DBSCAN(eps, min_samples, metric='cosine').fit(vectors).labels_"""
+    if backend not in BACKENDS:
+        raise ValueError(f"backend должен быть одним из {BACKENDS}, а не {backend}")
+    vectors = _normalize(vectors)
+    started = time.perf_counter()
+    if backend == "faiss" and len(vectors) >= FAISS_MIN_SIZE:
+        rows, cols = faiss_pairs(vectors, eps)
+    else:
+        rows, cols = blocked_pairs(vectors, eps)
+    graph_seconds = time.perf_counter() - started
+
+    labels = dbscan_labels(len(vectors), rows, cols, min_samples)
+    clusters = int(labels.max()) + 1 if len(labels) else 0
+    print(f"Граф соседей: {len(vectors)} фраз, {len(rows)} пар, {graph_seconds:.1f} с; "
+          f"кластеров {clusters}, шум {int((labels == -1).sum())}")
+    return labels
+
+
+def read_llm_groups(llm_path: str) -> list[tuple[str, list[str]]]:
+    """Группы (каноническое имя, навыки) из ответа LLM llm{step}{type}.json"""
+    with open(llm_path, encoding="utf-8") as f:
+        llm_data = json.load(f)
+    groups = []
+    for cluster in llm_data.values():
+        if cluster is None:
+            continue
+        for group in cluster:
+            groups.append((group["name"].strip(), [item.strip() for item in group["items"]]))
+    return groups
+
+
+def read_replacement_map(llm_path: str) -> dict[str, str]:
+    return {item: name for name, items in read_llm_groups(llm_path) for item in items}
+
+
+def fingerprint_files(paths: list[str]) -> str:
+    """sha256 содержимого файлов по порядку - для проверки, что результаты прогона не изменились"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(f"{os.path.basename(path)}:{os.path.getsize(path)}\0".encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def resolve_map(mapping: dict[str, str]) -> dict[str, str]:
+    """Замены одного шага до неподвижной точки: цепочки a -> b -> c сводятся в a -> c.
+
+    LLM может назвать группу так же, как навык из другой группы, отсюда
+    цепочки и циклы (a -> b, b -> a). Все навыки цикла получают наименьшее по
+    порядку имя из цикла.
+    """
+    resolved = {}
+    for start in mapping:
+        path, seen, name = [], {}, start
+        while name in mapping and name not in resolved and name not in seen:
+            seen[name] = len(path)
+            path.append(name)
+            name = mapping[name]
+        if name in resolved:
+            target = resolved[name]
+        elif name in seen:
+            cycle = path[seen[name]:]
+            target = min(cycle)
+            resolved.update((member, target) for member in cycle)
+            path = path[:seen[name]]
+        else:
+            target = name
+        resolved.update((member, target) for member in path)
+    return resolved
+
+
+def compose_maps(phrases, maps: list[dict[str, str]]) -> dict[str, str]:
+    """Итоговое имя каждой фразы после замен всех шагов по порядку, без цепочек и циклов"""
+    maps = [resolve_map(replacement_map) for replacement_map in maps]
+    result = {}
+    for phrase in phrases:
+        name = phrase
+        for replacement_map in maps:
+            name = replacement_map.get(name, name)
+        result[phrase] = name
+    return result
+
+
+class CanonicalIndex:
+    """Канонические группы навыков для инкрементальной кластеризации.
+
+    Группа - каноническое имя, сумма нормализованных векторов её навыков и их
+    число (центроид - нормализованная сумма). Известные навыки хранятся
+    словарём навык -> номер группы. Новый навык присоединяется к группе с
+    ближайшим центроидом, если косинусное расстояние до него не больше eps;
+    центроид при этом сдвигается. Сохраняется в .npz, строки - UTF-8 буфером.
+
+    source - отпечаток результатов полного прогона, по которым построен индекс
+    (см. fingerprint_files): если он изменился, индекс строится заново.
+    """
+
+    def __init__(self, names: list[str], sums: np.ndarray, counts: np.ndarray, members: dict[str, int],
+                 source: str = ""):
+        self.names = names
+        self.sums = sums
+        self.counts = counts
+        self.members = members
+        self.source = source
+        self._by_name = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def build(cls, canonical: dict[str, str], vectors: np.ndarray, source: str = "") -> "CanonicalIndex":
+        """canonical - фраза -> итоговое имя в порядке строк vectors"""
+        index = cls([], np.zeros((0, vectors.shape[1]), dtype=np.float32), np.zeros(0, dtype=np.int64), {}, source)
+        index.add(list(canonical.keys()), list(canonical.values()), vectors)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def unknown(self, phrases: list[str]) -> list[str]:
+        return [phrase for phrase in phrases if phrase not in self.members]
+
+    def add(self, phrases: list[str], names: list[str], vectors: np.ndarray):
+        """Добавляет фразы в группы с данными именами; группы с новыми именами создаются"""
+        vectors = _normalize(vectors)
+        groups = np.empty(len(phrases), dtype=np.int64)
+        for i, name in enumerate(names):
+            group = self._by_name.get(name)
+            if group is None:
+                group = self._by_name[name] = len(self.names)
+                self.names.append(name)
+            groups[i] = group
+        grown = len(self.names) - len(self.counts)
+        if grown:
+            self.sums = np.concatenate([self.sums, np.zeros((grown, self.sums.shape[1]), dtype=np.float32)])
+            self.counts = np.concatenate([self.counts, np.zeros(grown, dtype=np.int64)])
+        np.add.at(self.sums, groups, vectors)
+        np.add.at(self.counts, groups, 1)
+        self.members.update(zip(phrases, groups.tolist()))
+
+    def assign(self, phrases: list[str], vectors: np.ndarray, eps: float,
+               block_bytes: int = BLOCK_BYTES) -> tuple[dict[str, str], list[str]]:
+        """Присоединяет фразы к ближайшим группам в радиусе eps.
+
+        Возвращает (фраза -> каноническое имя для присоединённых, оставшиеся фразы).
+        """
+        vectors = _normalize(vectors)
+        if not len(self.names) or not len(phrases):
+            return {}, list(phrases)
+        centroids = _normalize(self.sums)
+        best = np.empty(len(vectors), dtype=np.int64)
+        best_sim = np.empty(len(vectors), dtype=np.float32)
+        block = max(1, block_bytes // (4 * len(centroids)))
+        for start in range(0, len(vectors), block):
+            sims = vectors[start:start + block] @ centroids.T
+            best[start:start + block] = sims.argmax(axis=1)
+            best_sim[start:start + block] = sims.max(axis=1)
+
+        matched = best_sim >= np.float32(1.0 - eps)
+        assigned = {phrase: self.names[group] for phrase, group, ok in zip(phrases, best.tolist(), matched) if ok}
+        self.add(list(assigned.keys()), list(assigned.values()), vectors[matched])
+        return assigned, [phrase for phrase, ok in zip(phrases, matched) if not ok]
+
+    def replacement_map(self) -> dict[str, str]:
+        """Навык -> каноническое имя для всех известных навыков, у которых оно другое"""
+        return {phrase: self.names[group] for phrase, group in self.members.items() if self.names[group] != phrase}
+
+    def save(self, path: str):
+        members = list(self.members.keys())
+        arrays = {"sums": self.sums, "counts": self.counts,
+                  "member_groups": np.array([self.members[m] for m in members], dtype=np.int64)}
+        arrays["names_data"], arrays["names_offsets"] = pack_strings(self.names)
+        arrays["members_data"], arrays["members_offsets"] = pack_strings(members)
+        arrays["source"] = np.frombuffer(self.source.encode("utf-8"), dtype=np.uint8)
+        out_dir = os.path.dirname(path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CanonicalIndex":
+        with np.load(path) as data:
+            members = unpack_strings(data["members_data"], data["members_offsets"])
+            source = data["source"].tobytes().decode("utf-8") if "source" in data else ""
+            return cls(unpack_strings(data["names_data"], data["names_offsets"]), data["sums"], data["counts"],
+                       dict(zip(members, data["member_groups"].tolist())), source)
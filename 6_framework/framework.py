@@ -1,15 +1,34 @@
-import pandas as pd
-import torch
-from sentence_transformers import SentenceTransformer, util
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.embedding_cache import EmbeddingCache
+from common.encoders import make_encoder
+from common.skill_table import SkillTable
 
 ETALON_PATH = "etalon.txt"
-INPUT_FILE = r"..\5_clusterization\results\result.csv"
+INPUT_FILE = os.path.join("..", "5_clusterization", "results", "result.npz")
 OUTPUT_FILE = "results/result.csv"
+OUTPUT_TABLE = "results/result.npz"
 
 SIM_THRESHOLD = 0.8
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+ENCODER_BACKEND = "torch"  # "onnx" - квантованная модель в onnxruntime, см. common/encoders.py
+# replace - навык заменяется ближайшим из эталона, keep - остаются навыки, похожие на эталон.
+# В обоих режимах навыки со сходством ниже SIM_THRESHOLD удаляются
+MODE = "replace"
+MODES = ("replace", "keep")
+
+model = make_encoder(MODEL_NAME, backend=ENCODER_BACKEND)
+embedding_cache = EmbeddingCache(model.cache_name)
 
-model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2", device=DEVICE)
+
+def encode(texts):
+    """Эмбеддинги через дисковый кэш: повторные запуски не пересчитывают известные строки"""
+    return embedding_cache.get_or_compute(texts, model.encode)
 
 
 def read_etalon_skills(file_path):
@@ -22,77 +41,57 @@ def read_etalon_skills(file_path):
     return skills
 
 
-etalon_skills = read_etalon_skills(ETALON_PATH)
-etalon_embeds = model.encode(etalon_skills,
-                             convert_to_tensor=True,
-                             normalize_embeddings=True)
+def match_etalon(skills: list[str], etalon_embeds: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Номер ближайшего навыка эталона и сходство с ним для каждой строки - одним умножением матриц"""
+    # Векторы нормализованы, поэтому косинусное сходство - скалярное произведение
+    sims = encode(skills) @ etalon_embeds.T
+    best = sims.argmax(axis=1)
+    return best, sims[np.arange(len(skills)), best]
 
 
-def filter_skills(skill_str):
-    """Замена на слово из эталона"""
-    if pd.isna(skill_str) or not skill_str.strip():
-        return ""
+def filter_soft_skills(table: SkillTable, etalon_skills: list[str], mode: str = MODE,
+                       threshold: float = SIM_THRESHOLD) -> SkillTable:
+    """Soft skills всех вакансий за один проход.
 
-    skills = [s.strip() for s in skill_str.split(';') if s.strip()]
+    Каждый различный навык кодируется и сравнивается с эталоном один раз,
+    затем коды навыков во всех вакансиях заменяются по полученному словарю.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode должен быть одним из {MODES}, а не {mode}")
+    _, codes = table.codes("soft")
+    skills = [table.skills[code] for code in np.unique(codes).tolist()]
     if not skills:
-        return ""
-
-    skill_embeds = model.encode(skills,
-                                convert_to_tensor=True,
-                                normalize_embeddings=True)
-
-    cos_scores = util.cos_sim(skill_embeds, etalon_embeds)
-
-    filtered_skills = []
-    for i, skill in enumerate(skills):
-        max_score, best_match_idx = torch.max(cos_scores[i], dim=0)
-        max_score = max_score.item()
-
-        if max_score >= SIM_THRESHOLD:
-            best_match = etalon_skills[best_match_idx]
-            filtered_skills.append(best_match)
-
-    return ';'.join(filtered_skills)
-
-
-# def filter_skills(skill_str):
-#     """Оставляем слова, похожие на эталон"""
-#     if pd.isna(skill_str) or not skill_str.strip():
-#         return ""
-
-#     skills = [s.strip() for s in skill_str.split(';') if s.strip()]
-#     if not skills:
-#         return ""
-
-#     skill_embeds = model.encode(skills,
-#                                 convert_to_tensor=True,
-#                                 normalize_embeddings=True)
-
-#     cos_scores = util.cos_sim(skill_embeds, etalon_embeds)
-
-#     max_scores, _ = torch.max(cos_scores, dim=1)
-
-#     filtered_skills = [
-#         skill
-#         for skill, score in zip(skills, max_scores.cpu().numpy())
-#         if score >= SIM_THRESHOLD
-#     ]
-
-#     return ';'.join(filtered_skills)
-
-
-print("Начинаем фильтрацию soft skills")
-df = pd.read_csv(INPUT_FILE, dtype={"_id": str})
-
-if 'soft_skills' not in df.columns:
-    raise ValueError("Колонка 'soft_skills' не найдена в CSV файле")
-
-print(f"Пример навыков до обработки:")
-print(df[['_id', 'soft_skills']].head(3))
-
-df['soft_skills'] = df['soft_skills'].apply(filter_skills)
-
-df.to_csv(OUTPUT_FILE, index=False, encoding="utf-8-sig")
-print(f"\nГотово! Отфильтрованные данные сохранены в {OUTPUT_FILE}")
-print(f"Пример обработанных навыков:")
-print(df[['_id', 'soft_skills']].head(3))
+        return table
+
+    best, scores = match_etalon(skills, encode(etalon_skills))
+    matched = scores >= threshold
+    if mode == "replace":
+        mapping = {skill: etalon_skills[i] if ok else None for skill, i, ok in zip(skills, best.tolist(), matched)}
+    else:
+        mapping = {skill: skill if ok else None for skill, ok in zip(skills, matched)}
+    print(f"Различных soft skills: {len(skills)}, похожих на эталон: {int(matched.sum())}, "
+          f"вхождений в вакансиях: {len(codes)}")
+    return table.replace_all({"soft": mapping})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сопоставление soft skills с эталоном")
+    parser.add_argument("--mode", choices=MODES, default=MODE,
+                        help="replace - заменить ближайшим навыком эталона, keep - оставить похожие")
+    parser.add_argument("--threshold", type=float, default=SIM_THRESHOLD)
+    args = parser.parse_args()
+
+    print("Начинаем фильтрацию soft skills")
+    table = SkillTable.read(INPUT_FILE)
+    print(f"Пример навыков до обработки:")
+    print(table.take(np.arange(min(3, len(table)))).to_frame()[['_id', 'soft_skills']])
+
+    filtered = filter_soft_skills(table, read_etalon_skills(ETALON_PATH), args.mode, args.threshold)
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    filtered.save(OUTPUT_TABLE)
+    df = filtered.to_frame()
+    df.to_csv(OUTPUT_FILE, index=False, encoding="utf-8-sig")
+    print(f"\nГотово! Отфильтрованные данные сохранены в {OUTPUT_FILE} и {OUTPUT_TABLE}")
+    print(f"Пример обработанных навыков:")
+    print(df[['_id', 'soft_skills']].head(3))
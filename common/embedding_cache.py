@@ -0,0 +1,264 @@
+"""Персистентный кэш эмбеддингов, общий для этапов фильтрации, кластеризации и фреймворка.
+
+Ключ записи - хэш от (имя модели, префикс вроде "query: ", нормализованный текст).
+Векторы одной модели лежат в одном бинарном файле, который открывается через
+np.memmap, рядом - файл ключей: номер строки в нём совпадает с номером вектора.
+Векторы хранятся в float32: при float16 сходства у порогов (0.95 фильтрации,
+0.8 фреймворка, eps DBSCAN) расходятся с прогоном без кэша.
+Запись только дописывается в конец, поэтому кэшем могут пользоваться несколько
+процессов одновременно (доступ сериализуется файловой блокировкой).
+
+Пример:
+    cache = EmbeddingCache("ai-forever/FRIDA")
+    vectors = cache.get_or_compute(phrases, encode, prefix="query: ")
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только внутри процесса
+    fcntl = None
+
+CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "embeddings"),
+)
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+# После вытеснения файл векторов занимает не больше этой доли от лимита
+EVICT_TO_FRACTION = 0.8
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация, по которой строятся ключи: NFC и схлопывание пробелов"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", str(text))).strip()
+
+
+def make_key(model_name: str, prefix: str, text: str) -> str:
+    payload = f"{model_name}\x1f{prefix}\x1f{text}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^0-9A-Za-z._-]+", "_", name)
+
+
+class EmbeddingCache:
+    """Кэш эмбеддингов одной модели: memmap-матрица векторов плюс индекс ключей"""
+
+    def __init__(self, model_name: str, cache_dir: str = CACHE_DIR, dtype: str = "float32",
+                 max_bytes: int = MAX_CACHE_BYTES):
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.max_bytes = max_bytes
+        self.dir = os.path.join(cache_dir, f"{_slug(model_name)}-{self.dtype.name}")
+        os.makedirs(self.dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._meta_path = os.path.join(self.dir, "meta.json")
+        self._lock_path = os.path.join(self.dir, "lock")
+
+        self.generation = -1
+        self.dim = None
+        self.index: dict[str, int] = {}
+        self._keys_offset = 0
+        self._vectors = None
+        # Порядок "свежести" строк для вытеснения: больше - свежее
+        self._last_used = np.zeros(0, dtype=np.int64)
+        self._tick = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        with self._locked():
+            self._refresh()
+
+    # ---------- файлы ----------
+
+    def _keys_path(self, generation: int) -> str:
+        return os.path.join(self.dir, f"keys.{generation}.txt")
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.dir, f"vectors.{generation}.bin")
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"generation": 0, "dim": None}
+
+    def _write_meta(self, generation: int, dim: int):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dtype": self.dtype.name,
+                       "generation": generation, "dim": dim}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _refresh(self):
+        """Подхватывает записи, дописанные другими процессами, или новое поколение после сжатия"""
+        meta = self._read_meta()
+        if meta["generation"] != self.generation:
+            self.generation = meta["generation"]
+            self.index = {}
+            self._keys_offset = 0
+            self._last_used = np.zeros(0, dtype=np.int64)
+        self.dim = meta["dim"]
+
+        keys_path = self._keys_path(self.generation)
+        if os.path.exists(keys_path):
+            with open(keys_path, "rb") as f:
+                f.seek(self._keys_offset)
+                tail = f.read()
+            # Недописанную последнюю строку пропускаем - её допишет владелец блокировки
+            complete = tail[:tail.rfind(b"\n") + 1]
+            self._keys_offset += len(complete)
+            for key in complete.decode("ascii").split():
+                self.index[key] = len(self.index)
+
+        self._remap()
+
+    def _remap(self):
+        rows = len(self.index)
+        if len(self._last_used) < rows:
+            added = np.arange(len(self._last_used), rows, dtype=np.int64)
+            self._last_used = np.concatenate([self._last_used, added])
+            self._tick = max(self._tick, rows)
+
+        if not rows or self.dim is None:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self._vectors_path(self.generation), dtype=self.dtype,
+                                  mode="r", shape=(rows, self.dim))
+
+    # ---------- публичный интерфейс ----------
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_or_compute(self, texts: list[str], encode, prefix: str = "") -> np.ndarray:
+        """Возвращает float32-матрицу эмбеддингов, досчитывая отсутствующие через encode.
+
+        encode получает список строк с префиксом и возвращает нормализованные векторы.
+        """
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+
+        normalized = [normalize_text(t) for t in texts]
+        keys = [make_key(self.model_name, prefix, t) for t in normalized]
+
+        text_by_key = dict(zip(keys, normalized))
+
+        with self._locked():
+            self._refresh()
+            missing = [k for k in text_by_key if k not in self.index]
+
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        # Кодируем без блокировки, чтобы не задерживать другие процессы
+        vectors = self._encode(encode, prefix, [text_by_key[k] for k in missing])
+
+        with self._locked():
+            self._refresh()
+            fresh = [i for i, key in enumerate(missing) if key not in self.index]
+            if fresh:
+                self._append([missing[i] for i in fresh], vectors[fresh])
+
+            # Между блокировками другой процесс мог сжать кэш и вытеснить часть записей
+            lost = [k for k in text_by_key if k not in self.index]
+            if lost:
+                self._append(lost, self._encode(encode, prefix, [text_by_key[k] for k in lost]))
+
+            rows = np.fromiter((self.index[k] for k in keys), dtype=np.int64, count=len(keys))
+            self._tick += 1
+            self._last_used[rows] = self._tick
+
+            if self.dim is None:
+                return np.zeros((0, 0), dtype=np.float32)
+            result = np.asarray(self._vectors[rows], dtype=np.float32)
+            self._evict_if_needed()
+            return result
+
+    @staticmethod
+    def _encode(encode, prefix: str, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.asarray(encode([prefix + t for t in texts]), dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError(f"encode вернул матрицу {vectors.shape} для {len(texts)} строк")
+        return vectors
+
+    def _append(self, keys: list[str], vectors: np.ndarray):
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._write_meta(self.generation, self.dim)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Размерность {vectors.shape[1]} не совпадает с кэшем ({self.dim})")
+
+        # Сначала векторы, потом ключи: ключ без вектора в файле не появится
+        row_bytes = self.dim * self.dtype.itemsize
+        with open(self._vectors_path(self.generation), "ab") as f:
+            f.truncate(len(self.index) * row_bytes)
+            f.write(vectors.astype(self.dtype).tobytes())
+        with open(self._keys_path(self.generation), "a", encoding="ascii") as f:
+            f.write("".join(f"{k}\n" for k in keys))
+
+        self._refresh()
+
+    def _evict_if_needed(self):
+        row_bytes = self.dim * self.dtype.itemsize
+        if len(self.index) * row_bytes <= self.max_bytes:
+            return
+
+        keep_rows = int(self.max_bytes * EVICT_TO_FRACTION) // row_bytes
+        keep = np.sort(np.argsort(self._last_used)[-keep_rows:]) if keep_rows else np.zeros(0, dtype=np.int64)
+        self._compact(keep)
+
+    def _compact(self, keep: np.ndarray):
+        """Переписывает кэш новым поколением, оставляя только строки keep"""
+        old_generation = self.generation
+        new_generation = old_generation + 1
+        keys = list(self.index.keys())
+
+        vectors = np.asarray(self._vectors[keep]) if len(keep) else np.zeros((0, self.dim), dtype=self.dtype)
+        with open(self._vectors_path(new_generation), "wb") as f:
+            f.write(vectors.tobytes())
+        with open(self._keys_path(new_generation), "w", encoding="ascii") as f:
+            f.write("".join(f"{keys[i]}\n" for i in keep))
+        last_used = self._last_used[keep]
+
+        self._vectors = None
+        self._write_meta(new_generation, self.dim)
+        self._refresh()
+        self._last_used = last_used
+
+        for path in (self._keys_path(old_generation), self._vectors_path(old_generation)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        print(f"Кэш эмбеддингов {self.model_name}: вытеснено {len(keys) - len(keep)} векторов")
+
+    def stats(self) -> dict:
+        return {"model": self.model_name, "size": len(self.index), "hits": self.hits, "misses": self.misses}
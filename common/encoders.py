@@ -0,0 +1,362 @@
+"""Бэкенды кодирования строк с общим интерфейсом.
+
+Все энкодеры возвращают L2-нормализованную float32-матрицу:
+    encoder = make_encoder("paraphrase-multilingual-MiniLM-L12-v2", backend="onnx")
+    vectors = encoder.encode(texts)
+
+Строки кодируются пачками, собранными по длине в токенах: строки сортируются по
+длине, пачка ограничена бюджетом MAX_BATCH_TOKENS (число строк x длина самой
+длинной) и числом строк batch_size, результат возвращается в исходном порядке.
+Короткие навыки идут большими пачками, длинные фразы - маленькими, почти без
+паддинга.
+
+torch - SentenceTransformer как раньше.
+onnx  - модель экспортируется в ONNX, веса квантуются в int8 (dynamic quantization)
+        и выполняются через onnxruntime на CPU. Экспорт делается один раз и
+        сохраняется в .cache/onnx.
+
+Проверка, что onnx не меняет поведение порогов (0.8 фреймворка, 0.95 фильтрации), из корня проекта:
+    python -m common.encoders parity --model paraphrase-multilingual-MiniLM-L12-v2 \\
+        --texts 4_merge_data/results/soft_skills_final.txt --against 6_framework/etalon.txt --threshold 0.8
+
+Сравнение с пачками фиксированного размера в произвольном порядке:
+    python -m common.encoders bench --model ai-forever/FRIDA --prefix "query: " \\
+        --texts 5_clusterization/results/0/hard0.txt 5_clusterization/results/0/soft0.txt
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+import numpy as np
+
+BACKENDS = ("torch", "onnx")
+ONNX_DIR = os.getenv(
+    "ONNX_MODELS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "onnx"),
+)
+# Бюджет пачки: число строк x длина самой длинной в токенах. batch_size остаётся потолком числа строк.
+# На CPU по замеру (bench на hard0/soft0) быстрее всего небольшие пачки, GPU загружается большими
+MAX_BATCH_TOKENS = 512
+GPU_MAX_BATCH_TOKENS = 16384
+MAX_BATCH_SIZE = 512
+_TOKENIZE_CHUNK = 10_000
+ONNX_OPSET = 14
+# Допуски проверки паритета: минимальный косинус между векторами бэкендов
+# и доля строк, у которых меняется решение по порогу
+PARITY_MIN_COSINE = 0.99
+PARITY_MAX_FLIP_RATE = 0.002
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+def token_lengths(tokenizer, texts: list[str], max_length: int) -> np.ndarray:
+    lengths = np.empty(len(texts), dtype=np.int64)
+    for start in range(0, len(texts), _TOKENIZE_CHUNK):
+        ids = tokenizer(texts[start:start + _TOKENIZE_CHUNK], truncation=True, max_length=max_length)["input_ids"]
+        lengths[start:start + len(ids)] = [len(row) for row in ids]
+    return lengths
+
+
+def length_batches(lengths: np.ndarray, max_tokens: int, max_size: int) -> list[np.ndarray]:
+    """Номера строк по возрастанию длины, разбитые на пачки в пределах бюджета токенов"""
+    order = np.argsort(lengths, kind="stable")
+    batches, start = [], 0
+    for end, length in enumerate(lengths[order].tolist(), 1):
+        # Строки отсортированы, поэтому самая длинная в пачке - последняя
+        if end - start > 1 and ((end - start) * length > max_tokens or end - start > max_size):
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+
+def encode_bucketed(encode_batch, tokenizer, texts: list[str], max_length: int,
+                    max_tokens: int = MAX_BATCH_TOKENS, max_size: int = MAX_BATCH_SIZE) -> np.ndarray:
+    """Кодирует пачками по длине и собирает одну нормализованную float32-матрицу в исходном порядке"""
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    result = None
+    for rows in length_batches(token_lengths(tokenizer, texts, max_length), max_tokens, max_size):
+        vectors = encode_batch([texts[i] for i in rows.tolist()])
+        if result is None:
+            result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+        result[rows] = vectors
+    return _normalize(result)
+
+
+class TorchEncoder:
+    """SentenceTransformer на torch"""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str, device: str | None = None, batch_size: int = MAX_BATCH_SIZE,
+                 max_batch_tokens: int | None = None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.cache_name = model_name
+        self.batch_size = batch_size
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.max_batch_tokens = max_batch_tokens or (GPU_MAX_BATCH_TOKENS if self.device.startswith("cuda")
+                                                     else MAX_BATCH_TOKENS)
+        self.model = SentenceTransformer(model_name, device=self.device)
+        self.tokenizer = self.model.tokenizer
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=True)
+
+    def encode(self, texts: list[str], batch_size: int | None = None) -> np.ndarray:
+        return encode_bucketed(self._encode_batch, self.tokenizer, texts, self.model.max_seq_length,
+                               self.max_batch_tokens, batch_size or self.batch_size)
+
+
+def onnx_model_dir(model_name: str, quantize: bool = True, onnx_dir: str = ONNX_DIR) -> str:
+    slug = re.sub(r"[^0-9A-Za-z._-]+", "_", model_name)
+    return os.path.join(onnx_dir, f"{slug}-{'int8' if quantize else 'fp32'}")
+
+
+def export_onnx(model_name: str, quantize: bool = True, onnx_dir: str = ONNX_DIR) -> str:
+    """Экспортирует трансформер SentenceTransformer в ONNX (и квантует в int8), возвращает папку"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = onnx_model_dir(model_name, quantize, onnx_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    pooling = "cls" if getattr(st_model[1], "pooling_mode_cls_token", False) else "mean"
+
+    sample = tokenizer(["пример текста", "ещё один пример"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    fp32_path = os.path.join(out_dir, "model_fp32.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(_LastHiddenState(transformer),
+                          tuple(sample[name] for name in input_names),
+                          fp32_path,
+                          input_names=input_names,
+                          output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes,
+                          opset_version=ONNX_OPSET)
+
+    model_path = os.path.join(out_dir, "model.onnx")
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+
+    tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, "encoder.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "pooling": pooling, "input_names": input_names,
+                   "max_seq_length": st_model.max_seq_length, "quantized": quantize}, f, ensure_ascii=False)
+
+    print(f"Модель {model_name} экспортирована в {out_dir}")
+    return out_dir
+
+
+class OnnxEncoder:
+    """Экспортированная модель в onnxruntime на CPU"""
+
+    backend = "onnx"
+
+    def __init__(self, model_name: str, quantize: bool = True, threads: int = 0,
+                 batch_size: int = MAX_BATCH_SIZE, max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 onnx_dir: str = ONNX_DIR):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.cache_name = f"{model_name}@onnx-{'int8' if quantize else 'fp32'}"
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+        model_dir = onnx_model_dir(model_name, quantize, onnx_dir)
+        if not os.path.exists(os.path.join(model_dir, "encoder.json")):
+            model_dir = export_onnx(model_name, quantize, onnx_dir)
+        with open(os.path.join(model_dir, "encoder.json"), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, "model.onnx"), options,
+                                            providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=self.config["max_seq_length"], return_tensors="np")
+        inputs = {name: tokens[name].astype(np.int64) for name in self.config["input_names"]}
+        hidden = self.session.run(["last_hidden_state"], inputs)[0]
+
+        if self.config["pooling"] == "cls":
+            return hidden[:, 0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, texts: list[str], batch_size: int | None = None) -> np.ndarray:
+        return encode_bucketed(self._encode_batch, self.tokenizer, texts, self.config["max_seq_length"],
+                               self.max_batch_tokens, batch_size or self.batch_size)
+
+
+def make_encoder(model_name: str, backend: str = "torch", device: str | None = None, threads: int = 0,
+                 batch_size: int = MAX_BATCH_SIZE):
+    """Создаёт энкодер выбранного бэкенда"""
+    if backend == "torch":
+        return TorchEncoder(model_name, device=device, batch_size=batch_size)
+    if backend == "onnx":
+        return OnnxEncoder(model_name, threads=threads, batch_size=batch_size)
+    raise ValueError(f"Неизвестный бэкенд {backend}, доступны: {', '.join(BACKENDS)}")
+
+
+def check_parity(reference, candidate, texts: list[str], against: list[str] | None = None,
+                 threshold: float | None = None) -> dict:
+    """Сравнивает два энкодера на одних строках.
+
+    Считает косинус между векторами бэкендов для каждой строки, а если заданы
+    against и threshold - ещё и долю строк, у которых меняется решение
+    "лучшее сходство с against >= threshold".
+    """
+    ref = reference.encode(texts)
+    cand = candidate.encode(texts)
+    cosines = (ref * cand).sum(axis=1)
+    report = {
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "max_abs_diff": float(np.abs(ref - cand).max()),
+    }
+
+    if against is not None and threshold is not None:
+        ref_best = (ref @ reference.encode(against).T).max(axis=1)
+        cand_best = (cand @ candidate.encode(against).T).max(axis=1)
+        flips = (ref_best >= threshold) != (cand_best >= threshold)
+        report.update({
+            "threshold": threshold,
+            "accepted_reference": int((ref_best >= threshold).sum()),
+            "accepted_candidate": int((cand_best >= threshold).sum()),
+            "flips": int(flips.sum()),
+            "flip_rate": float(flips.mean()),
+            "max_score_diff": float(np.abs(ref_best - cand_best).max()),
+        })
+
+    report["ok"] = report["min_cosine"] >= PARITY_MIN_COSINE and report.get("flip_rate", 0.0) <= PARITY_MAX_FLIP_RATE
+    return report
+
+
+def benchmark(encoder, texts: list[str], fixed_batch_size: int = 16, seed: int = 0) -> dict:
+    """Пачки фиксированного размера в произвольном порядке против пачек по длине на одних строках"""
+    texts = list(texts)
+    random.Random(seed).shuffle(texts)
+    max_length = getattr(encoder, "config", {}).get("max_seq_length") or encoder.model.max_seq_length
+    lengths = token_lengths(encoder.tokenizer, texts, max_length)
+    encoder._encode_batch(texts[:fixed_batch_size])  # прогрев, чтобы первый замер не включал инициализацию
+
+    started = time.perf_counter()
+    fixed = _normalize(np.concatenate([encoder._encode_batch(texts[i:i + fixed_batch_size])
+                                       for i in range(0, len(texts), fixed_batch_size)]))
+    fixed_seconds = time.perf_counter() - started
+    fixed_padded = sum(int(lengths[i:i + fixed_batch_size].max()) * len(lengths[i:i + fixed_batch_size])
+                       for i in range(0, len(texts), fixed_batch_size))
+
+    started = time.perf_counter()
+    bucketed = encoder.encode(texts)
+    bucketed_seconds = time.perf_counter() - started
+    batches = length_batches(lengths, encoder.max_batch_tokens, encoder.batch_size)
+    bucketed_padded = sum(int(lengths[rows].max()) * len(rows) for rows in batches)
+
+    return {
+        "texts": len(texts),
+        "tokens": int(lengths.sum()),
+        "fixed": {"batch_size": fixed_batch_size, "batches": -(-len(texts) // fixed_batch_size),
+                  "padding_share": round(1 - int(lengths.sum()) / fixed_padded, 4),
+                  "seconds": round(fixed_seconds, 2), "texts_per_second": round(len(texts) / fixed_seconds, 1)},
+        "bucketed": {"max_batch_tokens": encoder.max_batch_tokens, "batches": len(batches),
+                     "padding_share": round(1 - int(lengths.sum()) / bucketed_padded, 4),
+                     "seconds": round(bucketed_seconds, 2),
+                     "texts_per_second": round(len(texts) / bucketed_seconds, 1)},
+        "speedup": round(fixed_seconds / bucketed_seconds, 2),
+        "min_cosine": float((fixed * bucketed).sum(axis=1).min()),
+    }
+
+
+def _read_lines(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Экспорт моделей в ONNX и проверка паритета с torch")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="экспортировать модель в ONNX")
+    export.add_argument("--model", required=True)
+    export.add_argument("--fp32", action="store_true", help="без квантования")
+
+    parity = sub.add_parser("parity", help="сравнить onnx с torch")
+    parity.add_argument("--model", required=True)
+    parity.add_argument("--texts", required=True, help="файл со строками, по одной в строке")
+    parity.add_argument("--against", help="эталонные строки для проверки порога (профессии, эталон навыков)")
+    parity.add_argument("--threshold", type=float)
+    parity.add_argument("--prefix", default="", help='префикс модели, например "query: "')
+    parity.add_argument("--fp32", action="store_true")
+
+    bench = sub.add_parser("bench", help="сравнить пачки по длине с пачками фиксированного размера")
+    bench.add_argument("--model", required=True)
+    bench.add_argument("--texts", required=True, nargs="+", help="файлы со строками; каждый замеряется отдельно")
+    bench.add_argument("--backend", choices=BACKENDS, default="torch")
+    bench.add_argument("--prefix", default="")
+    bench.add_argument("--fixed-batch-size", type=int, default=16)
+    bench.add_argument("--max-batch-tokens", type=int, help="по умолчанию - как у энкодера")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "export":
+        export_onnx(args.model, quantize=not args.fp32)
+        return
+
+    if args.command == "bench":
+        encoder = make_encoder(args.model, backend=args.backend)
+        encoder.max_batch_tokens = args.max_batch_tokens or encoder.max_batch_tokens
+        for path in args.texts:
+            report = benchmark(encoder, [args.prefix + t for t in _read_lines(path)], args.fixed_batch_size)
+            print(json.dumps({"file": path, **report}, ensure_ascii=False, indent=2))
+        return
+
+    texts = [args.prefix + t for t in _read_lines(args.texts)]
+    against = [args.prefix + t for t in _read_lines(args.against)] if args.against else None
+    report = check_parity(TorchEncoder(args.model, device="cpu"),
+                          OnnxEncoder(args.model, quantize=not args.fp32),
+                          texts, against, args.threshold)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report["ok"]:
+        raise SystemExit("Паритет не выполнен: onnx-бэкенд меняет результаты сильнее допуска")
+
+
+if __name__ == "__main__":
+    main()
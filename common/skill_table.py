@@ -0,0 +1,489 @@
+"""Колоночный формат извлечённых навыков (npz) вместо строк "id | навык;навык | навык".
+
+Массивы в файле:
+    ids                          - ID вакансий
+    skills                       - общий словарь навыков, код навыка = индекс (int32)
+    hard_offsets, hard_codes     - CSR: hard skills вакансии i = hard_codes[hard_offsets[i]:hard_offsets[i + 1]]
+    soft_offsets, soft_codes     - то же для soft skills
+    professions, profession_codes - словарь профессий и код профессии вакансии (-1 - неизвестна)
+Строки (ids и словари) хранятся одним UTF-8 буфером со смещениями, так что
+навыки с ";" и "|" не ломают формат, а чтение не требует разбора текста.
+
+Пример:
+    table = SkillTable.load("2_getSkills/results/skills.npz")
+    hard = table.hard(0)
+    counts = np.bincount(table.hard_codes, minlength=len(table.skills))
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+_STRING_FIELDS = ("ids", "skills", "professions")
+
+
+def pack_strings(strings) -> tuple[np.ndarray, np.ndarray]:
+    """Список строк -> UTF-8 буфер и смещения"""
+    encoded = [str(s).encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_strings(data: np.ndarray, offsets: np.ndarray) -> list[str]:
+    buffer = data.tobytes()
+    return [buffer[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def split_skills(value) -> list[str]:
+    """Навыки из старого текстового представления "навык;навык" """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    return [skill.strip() for skill in str(value).split(";") if skill.strip()]
+
+
+class SkillTable:
+    """Навыки вакансий в колоночном виде"""
+
+    def __init__(self, ids: list[str], skills: list[str], hard_offsets: np.ndarray, hard_codes: np.ndarray,
+                 soft_offsets: np.ndarray, soft_codes: np.ndarray, professions: list[str] | None = None,
+                 profession_codes: np.ndarray | None = None, meta: dict | None = None):
+        self.ids = ids
+        self.skills = skills
+        self.hard_offsets = np.asarray(hard_offsets, dtype=np.int64)
+        self.hard_codes = np.asarray(hard_codes, dtype=np.int32)
+        self.soft_offsets = np.asarray(soft_offsets, dtype=np.int64)
+        self.soft_codes = np.asarray(soft_codes, dtype=np.int32)
+        self.professions = professions or []
+        if profession_codes is None:
+            profession_codes = np.full(len(ids), -1, dtype=np.int32)
+        self.profession_codes = np.asarray(profession_codes, dtype=np.int32)
+        self.meta = meta or {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls) -> "SkillTable":
+        zero = np.zeros(1, dtype=np.int64)
+        return cls([], [], zero, [], zero, [])
+
+    # --- доступ к строкам ---
+
+    def hard(self, i: int) -> list[str]:
+        return [self.skills[c] for c in self.hard_codes[self.hard_offsets[i]:self.hard_offsets[i + 1]]]
+
+    def soft(self, i: int) -> list[str]:
+        return [self.skills[c] for c in self.soft_codes[self.soft_offsets[i]:self.soft_offsets[i + 1]]]
+
+    def profession(self, i: int) -> str | None:
+        code = self.profession_codes[i]
+        return self.professions[code] if code >= 0 else None
+
+    def iter_rows(self):
+        """(id, профессия, hard, soft) по всем вакансиям"""
+        for i in range(len(self)):
+            yield self.ids[i], self.profession(i), self.hard(i), self.soft(i)
+
+    def codes(self, kind: str) -> tuple[np.ndarray, np.ndarray]:
+        """Смещения и коды навыков вида "hard" или "soft" """
+        if kind == "hard":
+            return self.hard_offsets, self.hard_codes
+        if kind == "soft":
+            return self.soft_offsets, self.soft_codes
+        raise ValueError(f"Неизвестный вид навыков: {kind}")
+
+    def row_index(self, kind: str) -> np.ndarray:
+        """Номер вакансии для каждого элемента кодов вида kind"""
+        offsets, _ = self.codes(kind)
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(offsets))
+
+    def unique_skills(self, kind: str) -> list[str]:
+        _, codes = self.codes(kind)
+        return [self.skills[c] for c in np.unique(codes)]
+
+    # --- преобразования ---
+
+    def with_professions(self, mapping) -> "SkillTable":
+        """Таблица с профессиями из словаря или Series _id -> профессия"""
+        categories = pd.Categorical(pd.Series(self.ids, dtype=object).map(mapping))
+        return self.with_profession_codes([str(p) for p in categories.categories], categories.codes)
+
+    def with_profession_codes(self, professions: list[str], codes: np.ndarray) -> "SkillTable":
+        """Таблица с готовым словарём профессий и кодом у каждой вакансии (-1 - нет профессии)"""
+        return SkillTable(self.ids, self.skills, self.hard_offsets, self.hard_codes, self.soft_offsets,
+                          self.soft_codes, list(professions), np.asarray(codes, dtype=np.int32), dict(self.meta))
+
+    def take(self, rows: np.ndarray) -> "SkillTable":
+        """Подтаблица из вакансий с номерами rows (или по булевой маске)"""
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+
+        def gather(offsets, codes):
+            lengths = np.diff(offsets)[rows]
+            new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=new_offsets[1:])
+            starts = np.repeat(offsets[rows] - new_offsets[:-1], lengths)
+            return new_offsets, codes[np.arange(new_offsets[-1]) + starts]
+
+        hard_offsets, hard_codes = gather(self.hard_offsets, self.hard_codes)
+        soft_offsets, soft_codes = gather(self.soft_offsets, self.soft_codes)
+        return SkillTable([self.ids[i] for i in rows.tolist()], self.skills, hard_offsets, hard_codes,
+                          soft_offsets, soft_codes, self.professions, self.profession_codes[rows], dict(self.meta))
+
+    def replace_skills(self, mapping: dict, kind: str) -> "SkillTable":
+        """Заменяет навыки вида kind по словарю старое -> новое, операцией над кодами"""
+        return self.replace_all({kind: mapping})
+
+    def replace_all(self, mappings: dict[str, dict]) -> "SkillTable":
+        """Замены для нескольких видов сразу: {"hard": словарь, "soft": словарь}, один новый словарь навыков.
+
+        Навык, отображённый в None, удаляется из вакансий.
+        """
+        skills = list(self.skills)
+        index = {skill: code for code, skill in enumerate(skills)}
+        remaps = {}
+        for kind, mapping in mappings.items():
+            remap = np.arange(len(self.skills), dtype=np.int32)
+            for code, skill in enumerate(self.skills):
+                if skill not in mapping:
+                    continue
+                target = mapping[skill]
+                if target is None:
+                    remap[code] = -1
+                    continue
+                if target not in index:
+                    index[target] = len(skills)
+                    skills.append(target)
+                remap[code] = index[target]
+            remaps[kind] = remap
+
+        columns = {}
+        for kind in ("hard", "soft"):
+            offsets, codes = self.codes(kind)
+            if kind in remaps:
+                codes = remaps[kind][codes]
+                keep = codes >= 0
+                if not keep.all():
+                    # Новое смещение строки - число оставшихся навыков до её начала
+                    offsets = np.concatenate(([0], np.cumsum(keep)))[offsets]
+                    codes = codes[keep]
+            columns[kind] = offsets, codes
+        return SkillTable(self.ids, skills, *columns["hard"], *columns["soft"],
+                          self.professions, self.profession_codes, dict(self.meta))
+
+    @classmethod
+    def concat(cls, tables: list["SkillTable"]) -> "SkillTable":
+        """Склеивает таблицы, объединяя словари навыков и профессий"""
+        builder = SkillTableBuilder()
+        parts = {"hard_offsets": [], "hard_codes": [], "soft_offsets": [], "soft_codes": []}
+        ids, profession_codes = [], []
+        hard_total = soft_total = 0
+        for table in tables:
+            skill_remap = np.array([builder.intern(s) for s in table.skills], dtype=np.int32)
+            prof_remap = np.array([builder.intern_profession(p) for p in table.professions] + [-1], dtype=np.int32)
+            ids.extend(table.ids)
+            profession_codes.append(prof_remap[table.profession_codes])
+            parts["hard_offsets"].append(table.hard_offsets[1:] + hard_total)
+            parts["soft_offsets"].append(table.soft_offsets[1:] + soft_total)
+            parts["hard_codes"].append(skill_remap[table.hard_codes] if len(table.hard_codes) else table.hard_codes)
+            parts["soft_codes"].append(skill_remap[table.soft_codes] if len(table.soft_codes) else table.soft_codes)
+            hard_total += len(table.hard_codes)
+            soft_total += len(table.soft_codes)
+
+        zero = [np.zeros(1, dtype=np.int64)]
+        return cls(ids, builder.skills,
+                   np.concatenate(zero + parts["hard_offsets"]), np.concatenate([[]] + parts["hard_codes"]),
+                   np.concatenate(zero + parts["soft_offsets"]), np.concatenate([[]] + parts["soft_codes"]),
+                   builder.professions, np.concatenate([[]] + profession_codes))
+
+    def drop_duplicate_ids(self, keep: str = "first") -> "SkillTable":
+        duplicated = pd.Series(self.ids, dtype=object).duplicated(keep=keep).to_numpy()
+        return self if not duplicated.any() else self.take(~duplicated)
+
+    # --- совместимость с CSV и текстом ---
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame в прежнем виде: _id, best_profession, hard_skills, soft_skills через ";" """
+        professions = np.array(self.professions + [""], dtype=object)
+        return pd.DataFrame({
+            "_id": self.ids,
+            "best_profession": professions[self.profession_codes],
+            "hard_skills": [";".join(self.hard(i)) for i in range(len(self))],
+            "soft_skills": [";".join(self.soft(i)) for i in range(len(self))],
+        })
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "SkillTable":
+        """Из DataFrame со столбцами _id, [best_profession], hard_skills, soft_skills"""
+        builder = SkillTableBuilder()
+        professions = df["best_profession"] if "best_profession" in df else [None] * len(df)
+        for job_id, profession, hard, soft in zip(df["_id"], professions, df["hard_skills"], df["soft_skills"]):
+            if isinstance(profession, float) and np.isnan(profession):
+                profession = None
+            builder.add(str(job_id), split_skills(hard), split_skills(soft), profession)
+        return builder.build()
+
+    @classmethod
+    def from_csv(cls, path: str) -> "SkillTable":
+        return cls.from_frame(pd.read_csv(path, dtype={"_id": str}, encoding="utf-8-sig"))
+
+    @classmethod
+    def from_text(cls, path: str) -> "SkillTable":
+        """Из старого results.txt: "id | навык;навык | навык" """
+        builder = SkillTableBuilder()
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                parts = line.strip().split("|")
+                if len(parts) != 3:
+                    continue
+                builder.add(parts[0].strip(), split_skills(parts[1]), split_skills(parts[2]))
+        return builder.build()
+
+    @classmethod
+    def read(cls, path: str) -> "SkillTable":
+        """Загружает .npz, .csv или старый текстовый формат по расширению"""
+        if path.endswith(".npz"):
+            return cls.load(path)
+        if path.endswith(".csv") or path.endswith(".csv.gz"):
+            return cls.from_csv(path)
+        return cls.from_text(path)
+
+    # --- файлы ---
+
+    def save(self, path: str):
+        """Атомарно сохраняет таблицу в .npz"""
+        arrays = {}
+        for field in _STRING_FIELDS:
+            arrays[f"{field}_data"], arrays[f"{field}_offsets"] = pack_strings(getattr(self, field))
+        arrays.update(hard_offsets=self.hard_offsets, hard_codes=self.hard_codes,
+                      soft_offsets=self.soft_offsets, soft_codes=self.soft_codes,
+                      profession_codes=self.profession_codes,
+                      meta=np.frombuffer(json.dumps(self.meta).encode("utf-8"), dtype=np.uint8))
+
+        out_dir = os.path.dirname(path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SkillTable":
+        with np.load(path) as data:
+            strings = {field: unpack_strings(data[f"{field}_data"], data[f"{field}_offsets"])
+                       for field in _STRING_FIELDS}
+            meta = json.loads(data["meta"].tobytes().decode("utf-8")) if "meta" in data else {}
+            return cls(strings["ids"], strings["skills"], data["hard_offsets"], data["hard_codes"],
+                       data["soft_offsets"], data["soft_codes"], strings["professions"],
+                       data["profession_codes"], meta)
+
+    @classmethod
+    def iter_load(cls, path: str, rows: int):
+        """Таблица из .npz частями по rows вакансий.
+
+        Числовые столбцы и буфер ID читаются целиком (это компактные массивы),
+        строки ID распаковываются только для текущей части. Части делят общие
+        словари навыков и профессий.
+        """
+        with np.load(path) as data:
+            skills = unpack_strings(data["skills_data"], data["skills_offsets"])
+            professions = unpack_strings(data["professions_data"], data["professions_offsets"])
+            ids_data, ids_offsets = data["ids_data"], data["ids_offsets"]
+            hard_offsets, hard_codes = data["hard_offsets"], data["hard_codes"]
+            soft_offsets, soft_codes = data["soft_offsets"], data["soft_codes"]
+            profession_codes = data["profession_codes"]
+            meta = json.loads(data["meta"].tobytes().decode("utf-8")) if "meta" in data else {}
+
+        total = len(ids_offsets) - 1
+        for start in range(0, total, rows):
+            stop = min(start + rows, total)
+            ids = ids_offsets[start:stop + 1]
+            hard = hard_offsets[start:stop + 1]
+            soft = soft_offsets[start:stop + 1]
+            yield cls(unpack_strings(ids_data[ids[0]:ids[-1]], ids - ids[0]), skills,
+                      hard - hard[0], hard_codes[hard[0]:hard[-1]], soft - soft[0], soft_codes[soft[0]:soft[-1]],
+                      professions, profession_codes[start:stop], meta)
+
+
+class SkillTableBuilder:
+    """Построчная сборка SkillTable с интернированием навыков и профессий"""
+
+    def __init__(self, base: SkillTable | None = None):
+        self.base = base
+        self.skills = list(base.skills) if base is not None else []
+        self.professions = list(base.professions) if base is not None else []
+        self._skill_index = {skill: code for code, skill in enumerate(self.skills)}
+        self._profession_index = {p: code for code, p in enumerate(self.professions)}
+        self.ids = []
+        self.hard_lengths, self.hard_codes = [], []
+        self.soft_lengths, self.soft_codes = [], []
+        self.profession_codes = []
+
+    def intern(self, skill: str) -> int:
+        code = self._skill_index.get(skill)
+        if code is None:
+            code = self._skill_index[skill] = len(self.skills)
+            self.skills.append(skill)
+        return code
+
+    def intern_profession(self, profession: str | None) -> int:
+        if profession is None or profession == "":
+            return -1
+        code = self._profession_index.get(profession)
+        if code is None:
+            code = self._profession_index[profession] = len(self.professions)
+            self.professions.append(profession)
+        return code
+
+    def add(self, job_id: str, hard: list[str], soft: list[str], profession: str | None = None):
+        self.ids.append(job_id)
+        self.hard_codes.extend(self.intern(s) for s in hard)
+        self.hard_lengths.append(len(hard))
+        self.soft_codes.extend(self.intern(s) for s in soft)
+        self.soft_lengths.append(len(soft))
+        self.profession_codes.append(self.intern_profession(profession))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def build(self) -> SkillTable:
+        base = self.base if self.base is not None else SkillTable.empty()
+
+        def offsets(base_offsets, lengths):
+            tail = base_offsets[-1] + np.cumsum(np.asarray(lengths, dtype=np.int64))
+            return np.concatenate([base_offsets, tail])
+
+        return SkillTable(
+            base.ids + self.ids,
+            self.skills,
+            offsets(base.hard_offsets, self.hard_lengths),
+            np.concatenate([base.hard_codes, np.asarray(self.hard_codes, dtype=np.int32)]),
+            offsets(base.soft_offsets, self.soft_lengths),
+            np.concatenate([base.soft_codes, np.asarray(self.soft_codes, dtype=np.int32)]),
+            self.professions,
+            np.concatenate([base.profession_codes, np.asarray(self.profession_codes, dtype=np.int32)]),
+            dict(base.meta),
+        )
+
+
+class SkillTableWriter:
+    """Запись большой таблицы по частям без сборки всех частей в памяти.
+
+    Коды и смещения каждой части дописываются в файлы рядом с выходным, в
+    памяти остаются только словари навыков и профессий. close() собирает .npz
+    того же формата, что SkillTable.save, читая части через mmap.
+
+    Пример:
+        writer = SkillTableWriter("results/merged.npz")
+        for path in paths:
+            writer.append(SkillTable.read(path))
+        writer.close()
+    """
+
+    _COLUMNS = {"ids_data": np.uint8, "ids_offsets": np.int64, "hard_offsets": np.int64,
+                "hard_codes": np.int32, "soft_offsets": np.int64, "soft_codes": np.int32,
+                "profession_codes": np.int32}
+
+    def __init__(self, path: str):
+        self.path = path
+        self.parts_dir = path + ".parts"
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self.builder = SkillTableBuilder()
+        self.rows = 0
+        self._remap_skills, self._skill_remap = None, None
+        self._totals = {"ids_data": 0, "hard_codes": 0, "soft_codes": 0}
+        self._files = {name: open(self._part_path(name), "wb") for name in self._COLUMNS}
+        for name in ("ids_offsets", "hard_offsets", "soft_offsets"):
+            np.zeros(1, dtype=np.int64).tofile(self._files[name])
+
+    def _part_path(self, name: str) -> str:
+        return os.path.join(self.parts_dir, f"{name}.bin")
+
+    def append(self, table: SkillTable):
+        # Части из SkillTable.iter_load делят словарь - перекодировка считается один раз
+        if table.skills is not self._remap_skills:
+            self._remap_skills = table.skills
+            self._skill_remap = np.array([self.builder.intern(s) for s in table.skills], dtype=np.int32)
+        skill_remap = self._skill_remap
+        prof_remap = np.array([self.builder.intern_profession(p) for p in table.professions] + [-1], dtype=np.int32)
+        ids_data, ids_offsets = pack_strings(table.ids)
+        columns = {
+            "ids_data": ids_data,
+            "ids_offsets": ids_offsets[1:] + self._totals["ids_data"],
+            "hard_offsets": table.hard_offsets[1:] + self._totals["hard_codes"],
+            "hard_codes": skill_remap[table.hard_codes],
+            "soft_offsets": table.soft_offsets[1:] + self._totals["soft_codes"],
+            "soft_codes": skill_remap[table.soft_codes],
+            "profession_codes": prof_remap[table.profession_codes],
+        }
+        for name, values in columns.items():
+            np.asarray(values, dtype=self._COLUMNS[name]).tofile(self._files[name])
+        self._totals["ids_data"] += len(ids_data)
+        self._totals["hard_codes"] += len(table.hard_codes)
+        self._totals["soft_codes"] += len(table.soft_codes)
+        self.rows += len(table)
+
+    def _read_part(self, name: str) -> np.ndarray:
+        path = self._part_path(name)
+        if not os.path.getsize(path):
+            return np.zeros(0, dtype=self._COLUMNS[name])
+        return np.memmap(path, dtype=self._COLUMNS[name], mode="r")
+
+    def close(self, meta: dict | None = None):
+        """Атомарно сохраняет .npz и удаляет файлы частей"""
+        for f in self._files.values():
+            f.close()
+        arrays = {name: self._read_part(name) for name in self._COLUMNS}
+        for field, strings in (("skills", self.builder.skills), ("professions", self.builder.professions)):
+            arrays[f"{field}_data"], arrays[f"{field}_offsets"] = pack_strings(strings)
+        arrays["meta"] = np.frombuffer(json.dumps(meta or {}).encode("utf-8"), dtype=np.uint8)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        arrays = None  # закрываем mmap до удаления файлов (Windows)
+        os.replace(tmp_path, self.path)
+        for name in self._COLUMNS:
+            os.remove(self._part_path(name))
+        os.rmdir(self.parts_dir)
+
+
+def append_journal(table_path: str, journal_path: str, legacy_path: str | None = None) -> SkillTable:
+    """Дописывает в таблицу строки JSONL-журнала экстрактора, появившиеся с прошлого раза.
+
+    Позиция в журнале хранится в meta таблицы. Если таблицы ещё нет, а есть
+    старый results.txt (legacy_path), он импортируется первым.
+    """
+    if os.path.exists(table_path):
+        table = SkillTable.load(table_path)
+    elif legacy_path and os.path.exists(legacy_path):
+        table = SkillTable.from_text(legacy_path)
+        print(f"Импортировано {len(table)} строк из {legacy_path}")
+    else:
+        table = SkillTable.empty()
+
+    offset = table.meta.get("journal_offset", 0)
+    if not os.path.exists(journal_path) or os.path.getsize(journal_path) <= offset:
+        if not os.path.exists(table_path) and len(table):
+            table.save(table_path)
+        return table
+
+    builder = SkillTableBuilder(table)
+    with open(journal_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # недописанная строка, дочитаем в следующий раз
+            offset += len(line)
+            record = json.loads(line)
+            builder.add(record["_id"], record["h"], record["s"])
+
+    table = builder.build()
+    table.meta["journal_offset"] = offset
+    table.save(table_path)
+    return table
@@ -0,0 +1,327 @@
+"""Запуск этапов пайплайна с пропуском тех, чьи входы не изменились.
+
+Для каждого этапа объявлены входы, выходы, параметры (константы из скриптов:
+пороги, модели, версия промпта) и код, от которого зависит результат. Отпечаток
+этапа - хэши содержимого входов и кода плюс значения параметров. Этап
+запускается, если отпечаток отличается от сохранённого после прошлого
+успешного запуска или какой-то из выходов отсутствует или пуст. Запуск
+считается успешным, только если после него все выходы есть и не пусты. Этапы
+идут по порядку, так что изменение выхода одного этапа делает устаревшими
+следующие.
+
+Хэши файлов кэшируются по размеру и времени изменения (.pipeline/hashes.json),
+состояние этапов - в .pipeline/state.json.
+
+Запуск:
+    python pipeline.py                  # все устаревшие этапы
+    python pipeline.py --status         # только показать, что устарело и почему
+    python pipeline.py --force clusterization   # перезапустить этап (и устаревшие после него)
+    python pipeline.py --until merge_data
+"""
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = os.path.join(ROOT, ".pipeline")
+STATE_PATH = os.path.join(STATE_DIR, "state.json")
+HASHES_PATH = os.path.join(STATE_DIR, "hashes.json")
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class Stage:
+    """Этап пайплайна. Пути - относительно корня репозитория, входы могут быть шаблонами glob.
+
+    params - {файл: [имена констант]}, значения читаются из исходника без его
+    выполнения. code - файлы, изменение которых меняет результат; у блокнотов
+    учитывается только код ячеек, не их вывод.
+    """
+
+    def __init__(self, name: str, directory: str, command: list[str], inputs: list[str], outputs: list[str],
+                 params: dict | None = None, code: list[str] | None = None):
+        self.name = name
+        self.directory = directory
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.code = code or []
+
+
+def _python(script: str) -> list[str]:
+    return [sys.executable, script]
+
+
+def _notebook(notebook: str) -> list[str]:
+    return [sys.executable, "-m", "jupyter", "nbconvert", "--to", "notebook", "--execute", "--inplace",
+            "--ExecutePreprocessor.timeout=-1", notebook]
+
+
+STAGES = [
+    Stage("filtration", "1_filtration", _python("run_filtration.py"),
+          inputs=["INPUT_DATA/professions.xlsx", "INPUT_DATA/hh_*.csv.bz2"],
+          outputs=["1_filtration/results/filtered_vacancies.csv.gz"],
+          params={"1_filtration/filtration.py": ["MODEL_NAME", "SIM_THRESHOLD", "MIN_DESC_LEN", "MAX_DESC_LEN",
+                                                 "MAX_RESULTS", "ENCODER_BACKEND", "USE_LEXICAL_INDEX"]},
+          code=["1_filtration/run_filtration.py", "1_filtration/filtration.py", "1_filtration/lexical_index.py",
+                "common/encoders.py", "common/embedding_cache.py"]),
+    # Код извлечения не входит в отпечаток: настройки параллельности и лимитов не меняют результат,
+    # а прогон дорогой. На результат влияют модель, промпт и сокращение описаний.
+    Stage("getSkills", "2_getSkills", _python("main.py"),
+          inputs=["1_filtration/results/filtered_vacancies.csv.gz"],
+          outputs=["2_getSkills/results/skills.npz", "2_getSkills/results/hard.txt",
+                   "2_getSkills/results/soft.txt"],
+          params={"2_getSkills/config.py": ["MODEL", "PROMPT_VERSION", "REDUCE_DESCRIPTIONS",
+                                            "BOILERPLATE_MIN_COUNT", "BOILERPLATE_MIN_CHARS"]}),
+    Stage("merge", "3_merge_with_profession", _python("merge_with_profession.py"),
+          inputs=["2_getSkills/results/skills.npz", "1_filtration/results/filtered_vacancies.csv.gz"],
+          outputs=["3_merge_with_profession/results/merged_skills.npz"],
+          code=["3_merge_with_profession/merge_with_profession.py", "common/skill_table.py"]),
+    Stage("merge_data", "4_merge_data", _python("merge_data.py"),
+          inputs=["3_merge_with_profession/results/merged_skills*.npz",
+                  "3_merge_with_profession/results/merged_skills*.csv",
+                  "2_getSkills/results/hard*.txt", "2_getSkills/results/soft*.txt"],
+          outputs=["4_merge_data/results/merged_skills_final.npz", "4_merge_data/results/hard_skills_final.txt",
+                   "4_merge_data/results/soft_skills_final.txt"],
+          params={"4_merge_data/merge_data.py": ["KEEP"]},
+          code=["4_merge_data/merge_data.py", "common/skill_table.py"]),
+    Stage("clusterization", "5_clusterization", _notebook("clusterization.ipynb"),
+          inputs=["4_merge_data/results/merged_skills_final.npz", "4_merge_data/results/hard_skills_final.txt",
+                  "4_merge_data/results/soft_skills_final.txt"],
+          outputs=["5_clusterization/results/result.npz", "5_clusterization/results/result.csv"],
+          params={"5_clusterization/clusterization.ipynb": ["MODEL_NAME", "ENCODER_BACKEND", "CLUSTER_BACKEND",
+                                                              "INCREMENTAL"]},
+          code=["5_clusterization/clusterization.ipynb", "5_clusterization/skill_clustering.py",
+                "5_clusterization/llm_journal.py", "common/skill_table.py", "common/encoders.py",
+                "common/embedding_cache.py"]),
+    Stage("framework", "6_framework", _python("framework.py"),
+          inputs=["5_clusterization/results/result.npz", "6_framework/etalon.txt"],
+          outputs=["6_framework/results/result.npz", "6_framework/results/result.csv"],
+          params={"6_framework/framework.py": ["MODEL_NAME", "SIM_THRESHOLD", "ENCODER_BACKEND", "MODE"]},
+          code=["6_framework/framework.py", "common/skill_table.py", "common/encoders.py",
+                "common/embedding_cache.py"]),
+    Stage("graph", "7_graph", _notebook("graph.ipynb"),
+          inputs=["6_framework/results/result.npz"],
+          outputs=["7_graph/output_matrix/profession_skills_matrix.npz"],
+          code=["7_graph/graph.ipynb"]),
+]
+
+
+def _abs(path: str) -> str:
+    return os.path.join(ROOT, *path.split("/"))
+
+
+def _load_json(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def notebook_code(path: str) -> str:
+    """Код ячеек блокнота без вывода и без строк-команд оболочки (!pip, %magic)"""
+    with open(path, "r", encoding="utf-8") as f:
+        notebook = json.load(f)
+    cells = ["".join(cell["source"]) for cell in notebook["cells"] if cell["cell_type"] == "code"]
+    return "\n\n".join(cells)
+
+
+def read_constants(path: str, names: list[str]) -> dict:
+    """Значения констант верхнего уровня из .py или блокнота без выполнения кода"""
+    source = notebook_code(path) if path.endswith(".ipynb") else open(path, "r", encoding="utf-8").read()
+    lines = [line for line in source.split("\n") if not line.lstrip().startswith(("!", "%"))]
+    values = {}
+    for node in ast.parse("\n".join(lines)).body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in names:
+                try:
+                    values[name] = ast.literal_eval(node.value)
+                except ValueError:
+                    values[name] = ast.unparse(node.value)
+    return values
+
+
+class FileHasher:
+    """sha256 содержимого файлов с кэшем по размеру и времени изменения"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.cache = _load_json(path)
+        self.hits = 0
+        self.misses = 0
+        self.hashed_bytes = 0
+
+    def hash(self, path: str) -> str:
+        stat = os.stat(path)
+        key = os.path.relpath(path, ROOT)
+        notebook = path.endswith(".ipynb")
+        cached = self.cache.get(key)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            self.hits += 1
+            return cached["sha256"]
+
+        digest = hashlib.sha256()
+        if notebook:
+            digest.update(notebook_code(path).encode("utf-8"))
+        else:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+        self.misses += 1
+        self.hashed_bytes += stat.st_size
+        self.cache[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def save(self):
+        _save_json(self.path, self.cache)
+
+
+def expand(patterns: list[str]) -> list[str]:
+    paths = []
+    for pattern in patterns:
+        matched = sorted(glob.glob(_abs(pattern))) if glob.has_magic(pattern) else [_abs(pattern)]
+        paths.extend(os.path.relpath(path, ROOT).replace(os.sep, "/") for path in matched)
+    return paths
+
+
+def fingerprint(stage: Stage, hasher: FileHasher) -> dict:
+    """Хэши входов и кода и значения параметров; отсутствующий вход отмечается как missing"""
+    files = {}
+    for path in expand(stage.inputs) + stage.code:
+        files[path] = hasher.hash(_abs(path)) if os.path.exists(_abs(path)) else "missing"
+    params = {}
+    for path, names in stage.params.items():
+        if os.path.exists(_abs(path)):
+            params.update({f"{path}:{name}": value for name, value in read_constants(_abs(path), names).items()})
+    return {"files": files, "params": params}
+
+
+def empty_output(path: str) -> bool:
+    """Пустой файл или таблица навыков (.npz с ids) без строк"""
+    if os.path.getsize(path) == 0:
+        return True
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return "ids_offsets" in data and len(data["ids_offsets"]) <= 1
+    return False
+
+
+def bad_outputs(stage: Stage) -> list[str]:
+    """Объявленные выходы этапа, которых нет или которые пусты"""
+    reasons = []
+    for path in stage.outputs:
+        if not os.path.exists(_abs(path)):
+            reasons.append(f"нет выхода {path}")
+        elif empty_output(_abs(path)):
+            reasons.append(f"пустой выход {path}")
+    return reasons
+
+
+def changes(old: dict | None, new: dict, stage: Stage) -> list[str]:
+    """Почему этап устарел; пустой список - актуален"""
+    if old is None:
+        return ["ещё не запускался"]
+    reasons = bad_outputs(stage)
+    old_files, old_params = old["fingerprint"]["files"], old["fingerprint"]["params"]
+    for path, digest in new["files"].items():
+        if old_files.get(path) != digest:
+            reasons.append(f"изменён {path}" if path in old_files else f"новый вход {path}")
+    reasons.extend(f"удалён вход {path}" for path in old_files if path not in new["files"])
+    for name, value in new["params"].items():
+        if old_params.get(name) != value:
+            reasons.append(f"{name}: {old_params.get(name)!r} -> {value!r}")
+    return reasons
+
+
+def run(stages: list[Stage], force: set, status_only: bool):
+    state = _load_json(STATE_PATH)
+    hasher = FileHasher(HASHES_PATH)
+    report = []
+    upstream_stale = False
+
+    for stage in stages:
+        hits, misses = hasher.hits, hasher.misses
+        current = fingerprint(stage, hasher)
+        reasons = changes(state.get(stage.name), current, stage)
+        if stage.name in force:
+            reasons.insert(0, "--force")
+        missing = [path for path, digest in current["files"].items() if digest == "missing"]
+        hashed = f"хэши: {hasher.hits - hits} из кэша, {hasher.misses - misses} посчитано"
+
+        if status_only:
+            if reasons:
+                print(f"[{stage.name}] устарел: {'; '.join(reasons)}")
+            elif upstream_stale:
+                print(f"[{stage.name}] актуален, но устареет после перезапуска предыдущих этапов")
+            else:
+                print(f"[{stage.name}] актуален")
+            upstream_stale = upstream_stale or bool(reasons)
+            continue
+
+        if not reasons:
+            print(f"[{stage.name}] актуален, пропуск ({hashed})")
+            report.append((stage.name, "пропущен", 0.0))
+            continue
+        if missing:
+            print(f"[{stage.name}] нет входов: {', '.join(missing)}")
+            report.append((stage.name, "нет входов", 0.0))
+            break
+
+        print(f"[{stage.name}] запуск: {'; '.join(reasons)} ({hashed})")
+        started = time.monotonic()
+        result = subprocess.run(stage.command, cwd=_abs(stage.directory))
+        seconds = time.monotonic() - started
+        if result.returncode != 0:
+            print(f"[{stage.name}] ошибка, код {result.returncode}, {seconds:.1f}s")
+            report.append((stage.name, "ошибка", seconds))
+            break
+        # Скрипт мог завершиться успешно, ничего не прочитав или записав результат не туда
+        bad = bad_outputs(stage)
+        if bad:
+            print(f"[{stage.name}] ошибка: {'; '.join(bad)}, {seconds:.1f}s")
+            report.append((stage.name, "нет выходов", seconds))
+            break
+
+        state[stage.name] = {"fingerprint": fingerprint(stage, hasher), "seconds": round(seconds, 1),
+                             "finished": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        _save_json(STATE_PATH, state)
+        report.append((stage.name, "выполнен", seconds))
+
+    hasher.save()
+    if report:
+        print("\nЭтап               Статус       Время")
+        for name, status, seconds in report:
+            print(f"{name:<18} {status:<12} {seconds:8.1f}s")
+    print(f"Хэши файлов: {hasher.hits} из кэша, {hasher.misses} посчитано "
+          f"({hasher.hashed_bytes / 2 ** 20:.1f} МБ прочитано)")
+
+
+if __name__ == "__main__":
+    names = [stage.name for stage in STAGES]
+    parser = argparse.ArgumentParser(description="Запуск устаревших этапов пайплайна")
+    parser.add_argument("--status", action="store_true", help="только показать состояние этапов")
+    parser.add_argument("--force", nargs="*", default=[], choices=names, metavar="STAGE",
+                        help="перезапустить этапы независимо от отпечатка")
+    parser.add_argument("--from", dest="start", choices=names, default=names[0], help="начать с этапа")
+    parser.add_argument("--until", choices=names, default=names[-1], help="остановиться после этапа")
+    args = parser.parse_args()
+
+    selected = STAGES[names.index(args.start):names.index(args.until) + 1]
+    run(selected, set(args.force), args.status)
@@ -10,6 +10,14 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _unpack_strings(data, offsets):
+    """
+    Decode strings packed as one UTF-8 buffer plus offsets
+    """
+    buffer = data.tobytes()
+    return [buffer[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
 class OptimizedDataProcessor:
     """
     Optimized data processor for large files (10GB+)
@@ -29,6 +37,9 @@ class OptimizedDataProcessor:
         logger.info(f"Starting processing of large file: {input_file_path}")
         os.makedirs(output_dir, exist_ok=True)
         
+        if input_file_path.endswith('.npz'):
+            return self.process_skill_table(input_file_path, output_dir)
+        
         # Phase 1: Stream through file to collect unique professions and skills
         logger.info("Phase 1: Collecting unique professions and skills...")
         self._collect_unique_values(input_file_path)
@@ -48,6 +59,47 @@ class OptimizedDataProcessor:
         logger.info(f"Processing complete! {len(profession_to_idx)} professions, {len(skill_to_idx)} skills")
         return len(profession_to_idx), len(skill_to_idx)
     
+    def process_skill_table(self, table_path, output_dir):
+        """
+        Build the matrix from a columnar skill table (.npz written by common/skill_table.py).
+        Skills and professions are already dictionary-encoded, so no text is parsed:
+        the (profession, skill) pairs come straight from the code arrays.
+        """
+        logger.info("Loading columnar skill table...")
+        with np.load(table_path) as table:
+            skills = _unpack_strings(table['skills_data'], table['skills_offsets'])
+            professions = _unpack_strings(table['professions_data'], table['professions_offsets'])
+            profession_codes = table['profession_codes']
+            columns = [(table[f'{kind}_offsets'], table[f'{kind}_codes'], prefix)
+                       for kind, prefix in (('hard', ''), ('soft', 'SOFT_'))]
+        
+        # Sorted mappings, same ordering as for the text format
+        profession_to_idx = {prof: idx for idx, prof in enumerate(sorted(professions))}
+        profession_map = np.array([profession_to_idx[prof] for prof in professions] + [-1], dtype=np.int64)
+        
+        names = sorted({prefix + skills[code] for _, codes, prefix in columns for code in np.unique(codes)})
+        skill_to_idx = {skill: idx for idx, skill in enumerate(names)}
+        
+        row_parts, col_parts = [], []
+        for offsets, codes, prefix in columns:
+            code_map = np.full(len(skills), -1, dtype=np.int64)
+            used = np.unique(codes)
+            code_map[used] = [skill_to_idx[prefix + skills[code]] for code in used]
+            vacancy = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            row_parts.append(profession_map[profession_codes[vacancy]])
+            col_parts.append(code_map[codes])
+        rows = np.concatenate(row_parts)
+        cols = np.concatenate(col_parts)
+        known = rows >= 0
+        
+        from scipy.sparse import coo_matrix
+        matrix = coo_matrix((np.ones(int(known.sum()), dtype=np.int32), (rows[known], cols[known])),
+                            shape=(len(profession_to_idx), len(skill_to_idx))).tocsr()
+        
+        self._save_results(output_dir, matrix, profession_to_idx, skill_to_idx)
+        logger.info(f"Processing complete! {len(profession_to_idx)} professions, {len(skill_to_idx)} skills")
+        return len(profession_to_idx), len(skill_to_idx)
+    
     def _collect_unique_values(self, file_path):
         """
         Stream through file to collect unique professions and skills